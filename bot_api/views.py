@@ -122,8 +122,12 @@ class DocumentBot:
     def __init__(self, domain, doc_id):
         self.id_local = diamonds.get_canonical(doc_id)
         self.dh = DocumentHistory.get(f"{domain}-{self.id_local}")
-        self.dv = DocumentVersion.get(domain, self.id_local, self.dh.latest_available)
-        self.dv.toc = ContentsTable.get(self.dv.toc.meta.id)
+        self.dv = DocumentVersion.get(
+            domain, self.id_local, self.dh.latest_available, history=self.dh
+        )
+        self.dv.toc = ContentsTable.from_es(
+            {"_id": self.dv.toc.meta.id, "_source": self.dv.toc.to_dict()}
+        )
         self.d_url = DEFAULT_IRI + f"/{domain}/{doc_id}/"
         self.d_name = document_name(
             self.dv.cover.id_human,
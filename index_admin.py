@@ -1,14 +1,18 @@
 from datetime import datetime
-from time import sleep
+import json
 import logging
 
-from elasticsearch.exceptions import ConnectionTimeout
-from flask import Blueprint, make_response, request
+from flask import Blueprint, make_response, request, jsonify, url_for
 from werkzeug.exceptions import NotFound
 
-from legislative_act.receiver import DocumentReceiver
+from legislative_act.history import (
+    DocumentHistory,
+    InconsistentVersionHistory,
+    source_hash,
+)
+from legislative_act.ingest import IngestQueue, IngestError, dry_run
 from utils import check_trustworthy, get_document_history
-from views.nationals import write_nationals
+from views.nationals import upsert_nationals
 from views.read import Read
 
 logger = logging.getLogger(__name__)
@@ -16,27 +20,66 @@ logger = logging.getLogger(__name__)
 
 def create_index_admin():
     index_admin = Blueprint("index_admin", __name__)
+    ingest_queue = IngestQueue()
 
     @index_admin.route("/<domain>/", methods=["POST"])
     @check_trustworthy
     def receive(domain):
-        # TODO: check if exists. If so, return error.
-        dr = DocumentReceiver.relaxed_instantiation(request.data.decode("utf-8"))
-        if domain != dr.domain:
-            return make_response("Inconsistent document domain", 422)
+        """Enqueues the document. It is incorporated by the ingest workers.
+        If the very same document has been uploaded before, nothing is done.
+        """
+        source = request.data.decode("utf-8")
+        present = DocumentHistory.find_upload(source_hash(source))
+        if present is not None:
+            return make_response(jsonify(document=present, status="present"), 200)
+        job_id = ingest_queue.enqueue(domain, source)
+        return make_response(
+            jsonify(
+                job=job_id,
+                status_url=url_for("index_admin.ingest_status", job_id=job_id),
+            ),
+            202,
+        )
+
+    @index_admin.route("/_backfill/<domain>/", methods=["POST"])
+    @check_trustworthy
+    def backfill(domain):
+        """Enqueues several versions of one document, uploaded as files
+        "documents", to be incorporated at once.
+        """
+        sources = [f.read().decode("utf-8") for f in request.files.getlist("documents")]
+        if not sources:
+            return make_response("No documents provided", 400)
+        job_id = ingest_queue.enqueue(domain, json.dumps(sources), "backfill")
+        return make_response(
+            jsonify(
+                job=job_id,
+                status_url=url_for("index_admin.ingest_status", job_id=job_id),
+            ),
+            202,
+        )
+
+    @index_admin.route("/_dry_run/<domain>/", methods=["POST"])
+    @check_trustworthy
+    def receive_dry_run(domain):
+        """Returns which parts the upload of the document would insert,
+        update, leave unchanged, or make obsolete. Nothing is written.
+        """
         try:
-            dr.save()
-        except Exception as e:
-            logger.error(f"Failed to load /{domain}/{dr.id_local}/{dr.version}")
-            dh = get_document_history(domain, dr.id_local)
-            if dh.latest == dr.version:
-                dh.remove_latest()
-            if type(e) is ConnectionTimeout:
-                sleep(10)  # give elasticsearch some time
-                dr.save()
-            else:
-                raise
-        return make_response(f"Uploaded to /{domain}/{dr.id_local}/{dr.version}", 200)
+            changes = dry_run(domain, request.data.decode("utf-8"))
+        except IngestError as e:
+            return make_response(str(e), 400)
+        except InconsistentVersionHistory as e:
+            return make_response(str(e), 409)
+        return jsonify(changes)
+
+    @index_admin.route("/_ingest/<int:job_id>", methods=["GET"])
+    @check_trustworthy
+    def ingest_status(job_id):
+        status = ingest_queue.status(job_id)
+        if status is None:
+            raise NotFound(f"No ingest job {job_id}")
+        return jsonify(status)
 
     @index_admin.route("/<domain>/<id_local>/", methods=["DELETE"])
     @check_trustworthy
@@ -62,20 +105,19 @@ def create_index_admin():
     @index_admin.route("/_national_ref/<domain>/", methods=["POST"])
     @check_trustworthy
     def write_national_reference(domain, id_local=None, sub_id="TOC"):
+        """Writes the references in data at once. The response
+        lists the result for each of them, in the same order.
+        """
         d = request.json
         target = domain
         if id_local is not None:
             target = f"{target}-{id_local}"
         if sub_id not in ("TOC", "COV"):
             target = f"{target}-{sub_id}"
-        c = 0
-        for c, kwargs in enumerate(d["data"]):
-            if "target" in kwargs:
-                assert kwargs["target"].startswith(target)
-            else:
-                kwargs["target"] = target
-            write_nationals(**kwargs)
-        return make_response(f"Posted {c+1} references.")
+        items = [{"target": target, **kwargs} for kwargs in d["data"]]
+        results = upsert_nationals(items, within=target)
+        posted = sum(r["result"] in ("created", "updated", "noop") for r in results)
+        return jsonify(posted=posted, results=results)
 
     @index_admin.route("/_unavailable/<domain>/<id_local>/<version>", methods=["POST"])
     @check_trustworthy
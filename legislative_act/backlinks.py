@@ -0,0 +1,55 @@
+"""
+Propagation of a document's relations to the documents it refers to:
+If document A amends document B, the latest cover of B obtains an anchor
+to A in its field "amended_by", and so on (cf. Cover.forth_back_anchors).
+The referred covers are retrieved with a single terms query, and the
+anchors are added by partial updates, sent in one bulk request.
+"""
+from collections import defaultdict
+from typing import Iterable
+
+from . import model as dm
+from .bulk import BulkActions
+
+
+def pending_backlinks(covers: Iterable[dm.Cover]) -> dict:
+    """Maps (domain, id_local) of each referred document to
+    {name of the back-referring field: [anchors to be added]}.
+    """
+    result = defaultdict(lambda: defaultdict(list))
+    for cover in covers:
+        anchor = cover.as_anchor().to_dict()
+        for id_local, back_names in cover.back_references().items():
+            for back_name in back_names:
+                result[(cover.abstract.domain, id_local)][back_name].append(anchor)
+    return result
+
+
+def propagate(covers: Iterable[dm.Cover]) -> int:
+    """Adds the anchors to the given covers to the latest covers of the
+    documents they refer to. Returns the number of updated covers.
+    """
+    pending = pending_backlinks(covers)
+    by_domain = defaultdict(list)
+    for domain, id_local in pending.keys():
+        by_domain[domain].append(id_local)
+    bulk = BulkActions()
+    for domain, id_locals in by_domain.items():
+        for hit in (
+            dm.Search()
+            .filter("term", doc_type="cover")
+            .filter("term", abstract__is_latest=True)
+            .filter("term", abstract__domain=domain)
+            .filter("terms", abstract__id_local=id_locals)
+            .scan()
+        ):
+            backs = pending[(domain, hit.abstract.id_local)]
+            for back_name, anchors in backs.items():
+                present = {a.href for a in getattr(hit, back_name, [])}
+                for anchor in anchors:
+                    if anchor["href"] not in present:
+                        bulk.append_anchor(hit.meta.id, back_name, anchor)
+    updated = len(bulk)
+    if updated:
+        bulk.commit()
+    return updated
@@ -0,0 +1,214 @@
+"""
+Collection of write operations on the index, to be sent in bulk.
+Instead of saving each ES-document of a document version on its own, the
+corresponding actions are gathered and then sent via the bulk helper of
+elasticsearch in sized chunks.
+"""
+from copy import deepcopy
+
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl import connections
+
+from settings import BULK_CHUNK_SIZE, BULK_MAX_CHUNK_BYTES
+from . import model as dm
+from . import refresh
+
+
+class BulkWriteError(Exception):
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__(
+            f"{len(errors)} bulk action(s) failed: "
+            + "; ".join(f"{e['op']} {e['_id']} ({e['status']})" for e in errors)
+        )
+
+
+class BulkActions:
+    """Ordered collection of index-, update- and delete-actions, keyed by
+    the ID of the concerned ES-document. Each ES-document is written at
+    most once: An update on a document that is yet to be indexed is applied
+    to the document itself.
+    Updates are scripted, so that only the few concerned values are sent
+    and version labels or anchors can be appended to already indexed
+    documents (or version labels removed).
+    Deleting a document that does not exist is not considered an error.
+    """
+
+    UPDATE_SCRIPT = (
+        "boolean changed = false;"
+        "for (entry in params.abstract.entrySet()) {"
+        "  if (ctx._source.abstract[entry.getKey()] != entry.getValue()) {"
+        "    ctx._source.abstract[entry.getKey()] = entry.getValue();"
+        "    changed = true;"
+        "  }"
+        "}"
+        "for (version in params.versions) {"
+        "  if (!ctx._source.abstract.version.contains(version)) {"
+        "    ctx._source.abstract.version.add(version);"
+        "    changed = true;"
+        "  }"
+        "}"
+        "if (params.containsKey('removed_versions')) {"
+        "  for (version in params.removed_versions) {"
+        "    int i = ctx._source.abstract.version.indexOf(version);"
+        "    if (i >= 0) {"
+        "      ctx._source.abstract.version.remove(i);"
+        "      changed = true;"
+        "    }"
+        "  }"
+        "}"
+        "if (params.containsKey('anchors')) {"
+        "  for (entry in params.anchors.entrySet()) {"
+        "    if (ctx._source[entry.getKey()] == null) {"
+        "      ctx._source[entry.getKey()] = new ArrayList();"
+        "    }"
+        "    def present = ctx._source[entry.getKey()];"
+        "    for (anchor in entry.getValue()) {"
+        "      boolean found = false;"
+        "      for (item in present) {"
+        "        if (item.href == anchor.href) { found = true; }"
+        "      }"
+        "      if (!found) {"
+        "        present.add(anchor);"
+        "        changed = true;"
+        "      }"
+        "    }"
+        "  }"
+        "}"
+        "if (!changed) { ctx.op = 'noop'; }"
+    )
+
+    def __init__(self):
+        self._actions = {}
+        self._detached = set()
+
+    def __len__(self):
+        return len(self._actions)
+
+    def __contains__(self, id_):
+        return id_ in self._actions
+
+    def index(self, doc: dm.Document):
+        self._actions[doc.meta.id] = ("index", doc)
+        self._detached.discard(doc.meta.id)
+
+    def update(self, id_, **abstract):
+        """Partial update of fields of the document's abstract,
+        e.g. update(id_, is_latest=False)
+        """
+        op, pending = self._pending_update(id_)
+        if op == "index":
+            for key, value in abstract.items():
+                setattr(pending.abstract, key, value)
+        elif op == "update":
+            pending["abstract"].update(abstract)
+
+    def append_version(self, id_, version):
+        """Adds the version label to the document's abstract.version"""
+        op, pending = self._pending_update(id_)
+        if op == "index":
+            if version not in pending.abstract.version:
+                pending.abstract.version.append(version)
+        elif op == "update":
+            if version not in pending["versions"]:
+                pending["versions"].append(version)
+
+    def remove_version(self, id_, version):
+        """Removes the version label from the document's abstract.version"""
+        op, pending = self._pending_update(id_)
+        if op == "index":
+            if version in pending.abstract.version:
+                pending.abstract.version.remove(version)
+        elif op == "update":
+            if version in pending["versions"]:
+                pending["versions"].remove(version)
+            else:
+                pending.setdefault("removed_versions", []).append(version)
+
+    def append_anchor(self, id_, field, anchor: dict):
+        """Adds the anchor to the given field of a cover,
+        unless the field contains an anchor with the same href already.
+        """
+        op, pending = self._pending_update(id_)
+        if op == "index":
+            anchors = getattr(pending, field)
+            if anchor["href"] not in {a.href for a in anchors}:
+                anchors.append(anchor)
+        elif op == "update":
+            anchors = pending.setdefault("anchors", {}).setdefault(field, [])
+            if anchor["href"] not in {a["href"] for a in anchors}:
+                anchors.append(anchor)
+
+    def _pending_update(self, id_):
+        if id_ not in self._actions:
+            self._actions[id_] = ("update", {"abstract": {}, "versions": []})
+        op, pending = self._actions[id_]
+        if op == "index" and id_ not in self._detached:
+            # The parts of a document version share one abstract. Changes
+            # concern this document only.
+            pending.abstract = dm.Abstract(**deepcopy(pending.abstract.to_dict()))
+            self._detached.add(id_)
+        return op, pending
+
+    def indexed(self) -> set:
+        """IDs of the documents to be indexed"""
+        return {id_ for id_, (op, _) in self._actions.items() if op == "index"}
+
+    def updated(self) -> set:
+        """IDs of the documents to be updated"""
+        return {id_ for id_, (op, _) in self._actions.items() if op == "update"}
+
+    def delete(self, id_):
+        self._actions[id_] = ("delete", None)
+
+    def iter_actions(self):
+        for id_, (op, pending) in self._actions.items():
+            if op == "index":
+                yield pending.as_action()
+            elif op == "update":
+                yield {
+                    "_op_type": "update",
+                    "_index": dm.index_name,
+                    "_id": id_,
+                    "script": {
+                        "source": self.UPDATE_SCRIPT,
+                        "lang": "painless",
+                        "params": pending,
+                    },
+                }
+            else:
+                yield {"_op_type": "delete", "_index": dm.index_name, "_id": id_}
+
+    def commit(self, **kwargs) -> list:
+        """Sends all collected actions and clears the collection.
+        Returns the per-item results. If any action failed, the
+        BulkWriteError lists every failed item.
+        """
+        kwargs = {**refresh.write_kwargs(), **kwargs}
+        results = []
+        errors = []
+        for ok, item in streaming_bulk(
+            connections.get_connection(),
+            self.iter_actions(),
+            chunk_size=BULK_CHUNK_SIZE,
+            max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+            raise_on_error=False,
+            max_retries=3,
+            **kwargs,
+        ):
+            op, result = item.popitem()
+            entry = {
+                "op": op,
+                "_id": result.get("_id"),
+                "status": result.get("status"),
+                "result": result.get("result"),
+            }
+            results.append(entry)
+            if not ok and not (op == "delete" and entry["status"] == 404):
+                entry["error"] = result.get("error")
+                errors.append(entry)
+        self._actions = {}
+        self._detached = set()
+        if errors:
+            raise BulkWriteError(errors)
+        return results
@@ -1,12 +1,27 @@
 from dataclasses import dataclass, field
-from functools import wraps
+from hashlib import sha1
+from time import sleep
 from typing import List
-from elasticsearch.exceptions import NotFoundError, ConnectionTimeout
+import logging
+from elasticsearch.exceptions import NotFoundError, ConflictError
+from elasticsearch_dsl import Q, connections
 from datetime import date
 
 from . import model as dm
+from . import refresh
+from .backlinks import propagate
+from .bulk import BulkActions
+from .instrumentation import phase
 from .model import art_sub_id
-from .utils.generics import retry
+from settings import (
+    PART_VERSION_LABELS,
+    VERSIONS_MAP_ATTEMPTS,
+    IN_FORCE_WAIT_MAX,
+    IN_FORCE_ATTEMPTS,
+    IN_FORCE_PROGRESS_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class VersionNotAvailable(Exception):
@@ -17,17 +32,9 @@ class InconsistentVersionHistory(Exception):
     pass
 
 
-def flushed(f):
-    """Decorator to flush the index before and after execution."""
-
-    @wraps(f)
-    def wrapped(*args, **kwargs):
-        dm.index.refresh()
-        result = f(*args, **kwargs)
-        dm.index.refresh()
-        return result
-
-    return wrapped
+def source_hash(source: str) -> str:
+    """Identifies an uploaded source document (cf. DocumentHistory.find_upload)"""
+    return sha1(source.encode("utf-8")).hexdigest()
 
 
 @dataclass
@@ -43,6 +50,7 @@ class DocumentVersion:
     articles: List[dm.Article] = field(default_factory=list)
     definitions: List[dm.Definition] = field(default_factory=list)
     available: bool = True
+    source_hash: str = None
 
     @property
     def domain(self):
@@ -70,14 +78,59 @@ class DocumentVersion:
             return DocumentHistory.get(f"{self.domain}-{self.id_local}")
         except NotFoundError:
             dh = self.default_version_map()
-            dh.save()
+            try:
+                dh.save()
+            except ConflictError:
+                # Someone else has just created it.
+                return DocumentHistory.get(dh.meta.id)
             return dh
 
-    @flushed
-    def save(self):
+    def find_history(self):
+        """Like get_history, but a new version map is not saved."""
+        try:
+            return DocumentHistory.get(f"{self.domain}-{self.id_local}")
+        except NotFoundError:
+            return self.default_version_map()
+
+    def changes(self, history=None) -> dict:
+        """What saving this version would change (cf. DocumentHistory.changes).
+        Nothing is written, not even an initial version map. If the
+        DocumentHistory is at hand already, it may be provided via <history>.
+        """
+        return (history or self.find_history()).changes(self)
+
+    @refresh.refreshed
+    def save(self, backlinks=True):
+        """If <backlinks> is False, the relations to other documents are
+        not propagated, e.g. since this is deferred (cf. backlinks.propagate).
+        """
         if self.date_document is None:
             raise ValueError("eli:date_document needs to be provided")
-        self.get_history().incorporate(self)
+        with phase("history"):
+            history = self.get_history()
+        history.incorporate(self)
+        if backlinks:
+            with phase("backlinks"):
+                propagate([self.cover])
+
+    @staticmethod
+    @refresh.refreshed
+    def save_all(docs: List["DocumentVersion"], backlinks=True):
+        """Saves several versions of the same document in chronological order.
+        Same result as saving one after another, but written in one go.
+        """
+        if len({(doc.domain, doc.id_local) for doc in docs}) != 1:
+            raise ValueError("Versions of exactly one document expected")
+        for doc in docs:
+            if doc.date_document is None:
+                raise ValueError("eli:date_document needs to be provided")
+        docs = sorted(docs, key=lambda doc: doc.date_document)
+        with phase("history"):
+            history = docs[0].get_history()
+        history.backfill(docs)
+        if backlinks:
+            with phase("backlinks"):
+                propagate([doc.cover for doc in docs])
 
     def delete(self):
         """Note that this only deletes those es-documents with the actual
@@ -87,36 +140,41 @@ class DocumentVersion:
             es_doc.delete()
 
     def default_version_map(self) -> dm.VersionsMap:
-        result = DocumentHistory(availabilities=[], exposed_and_hidden=[])
+        result = DocumentHistory(
+            availabilities=[], exposed_and_hidden=[], change_log=[]
+        )
         result.meta.id = "{}-{}".format(self.domain, self.id_local)
         return result
 
     @classmethod
-    def get(cls, domain, id_local, version):
+    def get(cls, domain, id_local, version, history=None):
         """Creates instance from elasticsearch.
         If no version is provided, the latest version
         (not the latest available version!) is returned.
+        All parts are loaded via multi-get. If the DocumentHistory is
+        at hand already, it may be provided via <history>.
         """
-        vm = DocumentHistory.get("{}-{}".format(domain, id_local))
+        vm = history or DocumentHistory.get("{}-{}".format(domain, id_local))
         if not vm.version_to_availability[version]:
             raise VersionNotAvailable(
                 f"For the document with id_local={repr(id_local)} (domain={domain}), "
                 f"the version {repr(version)}. is not indexes."
             )
         stg = vm.sub_to_global_id(version)
+        parts = dm.get_many(stg.values())
         return cls(
             version=version,
             date_document=vm.version_to_date[version],
-            cover=dm.Cover.get(stg["COV"]),
-            toc=dm.ContentsTable.get(stg["TOC"]),
-            preamble=dm.Preamble.get(stg["PRE"]),
+            cover=parts[stg["COV"]],
+            toc=parts[stg["TOC"]],
+            preamble=parts[stg["PRE"]],
             articles=[
-                dm.Article.get(global_id)
+                parts[global_id]
                 for sub_id, global_id in stg.items()
                 if art_sub_id(sub_id)
             ],
             definitions=[
-                dm.Definition.get(global_id)
+                parts[global_id]
                 for sub_id, global_id in stg.items()
                 if sub_id.startswith("DEF_")
             ],
@@ -128,6 +186,28 @@ class DocumentHistory(dm.VersionsMap):
     def id_local(self):
         return self.meta.id.split("-")[1]
 
+    @staticmethod
+    def find_upload(digest: str):
+        """Path of the version that has been uploaded
+        with the given source_hash, or None.
+        """
+        s = (
+            dm.Search()
+            .filter("term", doc_type="versionsmap")
+            .filter(
+                "nested",
+                path="availabilities",
+                query=Q("term", availabilities__source_hash=digest),
+            )
+            .source(["availabilities"])[:1]
+        )
+        for hit in s.execute():
+            domain, id_local = hit.meta.id.split("-")
+            for availability in hit.availabilities:
+                if getattr(availability, "source_hash", None) == digest:
+                    return f"/{domain}/{id_local}/{availability.version}"
+        return None
+
     @property
     def domain(self):
         return self.meta.id.split("-")[0]
@@ -148,24 +228,29 @@ class DocumentHistory(dm.VersionsMap):
             if availability.available:
                 return availability.version
 
+    def global_id(self, eh: dm.ExposedAndHiddenVersions):
+        return "-".join((self.meta.id, eh.sub_id, eh.hidden_version))
+
     def sub_to_global_id(self, version):
-        result = {
-            item.sub_id: "-".join((self.meta.id, item.sub_id, item.hidden_version))
-            for item in self.exposed_and_hidden
-            if version in item.exposed_versions
+        return {
+            sub_id: self.global_id(item)
+            for sub_id, item in self.entries(version).items()
         }
-        return result
 
-    def get_latest_loaded(self):
-        latest_available = self.latest_available
-        if latest_available is None:
-            return {}
-        return {
-            part.sub_id: part
-            for part in DocumentVersion.get(
-                self.domain, self.id_local, latest_available
-            ).iter_parts()
+    def entries(self, version) -> dict:
+        """Maps each sub_id of the given version to its entry in
+        exposed_and_hidden, i.e. to its hidden version and fingerprint.
+        """
+        return self.version_index.version_entries(version)
+
+    def complete_fingerprints(self, entries):
+        """Entries from before the introduction of fingerprints obtain them
+        from the corresponding indexed ES-document."""
+        incompletes = {
+            self.global_id(eh): eh for eh in entries if eh.fingerprint is None
         }
+        for id_, part in dm.get_many(incompletes.keys()).items():
+            incompletes[id_].fingerprint = part.compute_fingerprint()
 
     def append_availability(self, availability: dm.VersionAvailability):
         if self.availabilities:
@@ -178,71 +263,262 @@ class DocumentHistory(dm.VersionsMap):
 
     def incorporate(self, doc: DocumentVersion):
         """Goes through every Article and further ES-documents:
-        1) compares each of them with the corresponding latest indexed
-            a) if equivalent indexed ES-document is found:
+        1) compares the fingerprint of each of them with the one of the
+           corresponding latest indexed
+            a) if the fingerprints are equal:
                 update version map!
             b) else: save it and update the version map.
         2) save the version map.
+        The ES-documents are not saved one by one. All writes are collected
+        and sent as bulk request, before the version map is saved.
+        """
+        self._write([doc])
+
+    def backfill(self, docs: List[DocumentVersion]):
+        """Incorporates several versions at once, in the given order.
+        The version map and the ES-documents are computed in memory, as if
+        the versions were incorporated one after another. Then, all
+        ES-documents are written with a single bulk request, and finally
+        the version map is saved. If the bulk request fails, the version
+        map is not saved, i.e. remains as before, and the written
+        ES-documents are rolled back.
+        """
+        self._write(docs)
+
+    def _write(self, docs: List[DocumentVersion]):
+        """If the version map has been changed concurrently (ConflictError on
+        saving it), the versions are incorporated again into its current
+        state. Documents indexed by the previous attempt, which are not
+        part of the repeated one, are deleted along the way.
+        If it fails nonetheless, the writes are rolled back (cf. _roll_back).
+        """
+        history = self
+        written = set()
+        # All documents indexed or updated by any attempt:
+        touched = {"indexed": set(), "updated": set()}
+        # The bulk actions may replace the parts' abstracts by altered copies
+        # (cf. BulkActions._pending_update). Each attempt starts afresh.
+        abstracts = [(part, part.abstract) for doc in docs for part in doc.iter_parts()]
+        try:
+            for attempt in range(1, VERSIONS_MAP_ATTEMPTS + 1):
+                for part, abstract in abstracts:
+                    part.abstract = abstract
+                bulk = BulkActions()
+                with phase("compare"):
+                    for doc in docs:
+                        history._incorporate(doc, bulk)
+                indexed = bulk.indexed()
+                for id_ in written - indexed:
+                    bulk.delete(id_)
+                touched["indexed"] |= indexed
+                touched["updated"] |= bulk.updated()
+                with phase("bulk"):
+                    bulk.commit()
+                written = indexed
+                try:
+                    with phase("versions_map"):
+                        history.save()
+                except ConflictError:
+                    if attempt == VERSIONS_MAP_ATTEMPTS:
+                        raise
+                    with phase("history"):
+                        history = DocumentHistory.get(self.meta.id)
+                else:
+                    break
+        except Exception:
+            if touched["indexed"] or touched["updated"]:
+                self._roll_back(
+                    touched["indexed"],
+                    touched["updated"],
+                    [doc.version for doc in docs],
+                )
+            raise
+        history._delete_superseded()
+
+    def _roll_back(self, indexed: set, updated: set, versions: list):
+        """Makes the index consistent with the stored version map again after
+        a failed write: The indexed documents are deleted, the version labels
+        are removed from the updated ones, and the flags of the stored latest
+        version are restored. Documents and versions that the stored map
+        refers to, e.g. due to a concurrent write, are left alone.
+        """
+        with phase("history"):
+            stored = DocumentHistory.get(self.meta.id)
+        referred = {stored.global_id(eh) for eh in stored.exposed_and_hidden}
+        known = {a.version for a in stored.availabilities}
+        versions = [v for v in versions if v not in known]
+        bulk = BulkActions()
+        for id_ in indexed - referred:
+            bulk.delete(id_)
+        if PART_VERSION_LABELS == "script":
+            for id_ in updated - indexed:
+                for version in versions:
+                    bulk.remove_version(id_, version)
+        if stored.availabilities:
+            stored._restore_flags(bulk)
+        with phase("bulk"):
+            bulk.commit()
+
+    def _previous_entries(self) -> dict:
+        """Entries, with fingerprints, to which a new version's parts
+        are compared to.
         """
-        assert doc.domain == self.domain and doc.id_local == self.id_local
-        latest_loaded = self.get_latest_loaded()
         latest = self.latest
+        previous = self.entries(self.latest_available)
+        if latest is not None and latest != self.latest_available:
+            previous["COV"] = self.entries(latest)["COV"]
+        self.complete_fingerprints(previous.values())
+        return previous
+
+    def _neighbours(self, doc: DocumentVersion):
+        """If the given version precedes an available version by date, it is
+        inserted in between the existing ones. Returns the position of its
+        availability and the entries, with fingerprints, of the previous and
+        the following version. Otherwise (i.e. the version is appended), None.
+        """
+        if not any(
+            a.available and a.date_document > doc.date_document
+            for a in self.availabilities
+        ):
+            return None
+        position = 0
+        for i, availability in enumerate(self.availabilities):
+            if availability.date_document <= doc.date_document:
+                position = i + 1
+        versions = [a.version for a in self.availabilities]
+        previous = self._closest_entries(reversed(versions[:position]))
+        following = self._closest_entries(versions[position:])
+        self.complete_fingerprints(list(previous.values()) + list(following.values()))
+        return position, previous, following
+
+    def _closest_entries(self, versions) -> dict:
+        """Entries of the first available of the given versions. The cover
+        is the one of the first version having one, e.g. of a stub.
+        """
+        available = self.version_to_availability
+        cover = None
+        for version in versions:
+            entries = self.entries(version)
+            if cover is None:
+                cover = entries.get("COV")
+            if available[version]:
+                if cover is not None:
+                    entries["COV"] = cover
+                return entries
+        return {} if cover is None else {"COV": cover}
+
+    def _expose(self, eh: dm.ExposedAndHiddenVersions, version):
+        """Adds the version to the entry's exposed versions, in chronological
+        order behind the hidden version.
+        """
+        dates = self.version_to_date
+        exposed = eh.exposed_versions
+        position = len(exposed)
+        for i in range(1, len(exposed)):
+            if dates[exposed[i]] > dates[version]:
+                position = i
+                break
+        exposed.insert(position, version)
+
+    def changes(self, doc: DocumentVersion) -> dict:
+        """Change set that incorporating the given version would yield.
+        Nothing is written: The parts are compared via the fingerprints
+        recorded in the version map.
+        """
+        assert doc.domain == self.domain and doc.id_local == self.id_local
+        if doc.version in {a.version for a in self.availabilities}:
+            raise InconsistentVersionHistory(
+                f"Version {doc.version} already available "
+                f"for {self.domain}-{self.id_local}."
+            )
+        neighbours = self._neighbours(doc)
+        if neighbours is None:
+            previous, following = self._previous_entries(), {}
+        else:
+            _, previous, following = neighbours
+        result = {"insert": [], "update": [], "unchanged": [], "obsolete": []}
+        for part in doc.iter_parts():
+            fingerprint = part.fingerprint or part.compute_fingerprint()
+            previous_entry = previous.get(part.sub_id)
+            following_entry = following.get(part.sub_id)
+            if fingerprint in (
+                getattr(previous_entry, "fingerprint", None),
+                getattr(following_entry, "fingerprint", None),
+            ):
+                result["unchanged"].append(part.sub_id)
+            elif previous_entry is None:
+                result["insert"].append(part.sub_id)
+            else:
+                result["update"].append(part.sub_id)
+        availables = [a.version for a in self.availabilities if a.available]
+        if doc.available and availables and neighbours is None:
+            new_sub_ids = set(p.sub_id for p in doc.iter_parts())
+            result["obsolete"] = [
+                sub_id
+                for sub_id in self.entries(availables[-1])
+                if sub_id not in new_sub_ids
+            ]
+        result["toc_changed"] = "TOC" in result["insert"] + result["update"]
+        return result
+
+    def _incorporate(self, doc: DocumentVersion, bulk: BulkActions):
+        assert doc.domain == self.domain and doc.id_local == self.id_local
+        neighbours = self._neighbours(doc)
+        if neighbours is not None:
+            self._insert(doc, bulk, *neighbours)
+            self.changed()
+            # The following version's predecessor is a different one now.
+            return self._log_changes(
+                self._available_from(neighbours[0]),
+                self._available_from(neighbours[0] + 1),
+            )
+        previous = self._previous_entries()
         self.append_availability(
             dm.VersionAvailability(
                 version=doc.version,
                 date_document=doc.date_document,
                 available=doc.available,
+                source_hash=doc.source_hash,
             )
         )
         for new_part in doc.iter_parts():
-            if new_part.sub_id == "COV":
-                new_part.consist_relations()
-            if (
-                new_part.sub_id != "COV"
-                or latest == self.latest_available
-                or latest is None
-            ):
-                latest_loaded_part = latest_loaded.get(new_part.sub_id)
-            else:
-                latest_loaded_part = dm.Cover.get(self.sub_to_global_id(latest)["COV"])
+            if new_part.fingerprint is None:
+                new_part.fingerprint = new_part.compute_fingerprint()
             new_part.abstract.is_latest = True
-            if latest_loaded_part is None:
+            previous_entry = previous.get(new_part.sub_id)
+            if previous_entry is None:
                 # Case: the new doc has a completely new part.
-                new_part.save()
+                bulk.index(new_part)
                 self.exposed_and_hidden.append(
                     dm.ExposedAndHiddenVersions(
                         sub_id=new_part.sub_id,
                         hidden_version=doc.version,
                         exposed_versions=[doc.version],
+                        fingerprint=new_part.fingerprint,
                     )
                 )
-            elif new_part == latest_loaded_part:
+            elif new_part.fingerprint == previous_entry.fingerprint:
                 # Case: this part of this version is identical to
                 # the corresponding part of the already loaded one.
-                self.hidden_to_exposed[new_part.sub_id][
-                    latest_loaded_part.version
-                ].append(doc.version)
-                latest_loaded_part.abstract.version.append(doc.version)
-                latest_loaded_part.save()
+                previous_entry.exposed_versions.append(doc.version)
+                if PART_VERSION_LABELS == "script":
+                    bulk.append_version(self.global_id(previous_entry), doc.version)
             else:
                 # Case: this part of this version of the document differs
                 # from the corresponding part of the already stored version.
                 if new_part.sub_id != "COV":
-                    latest_loaded_part.abstract.in_force = False
-                latest_loaded_part.abstract.is_latest = False
-                latest_loaded_part.save()
-                try:
-                    new_part.save()
-                except Exception as e:
-                    self.remove_latest()  # basically a rollback
-                    raise e
+                    bulk.update(self.global_id(previous_entry), in_force=False)
+                bulk.update(self.global_id(previous_entry), is_latest=False)
+                bulk.index(new_part)
                 self.exposed_and_hidden.append(
                     dm.ExposedAndHiddenVersions(
                         sub_id=new_part.sub_id,
                         hidden_version=new_part.version,
                         exposed_versions=[new_part.version],
+                        fingerprint=new_part.fingerprint,
                     )
                 )
+        self.changed()
         # Finally, set in_force flag of obsolete leaves to False
         availables = [
             a.version
@@ -250,22 +526,101 @@ class DocumentHistory(dm.VersionsMap):
             if a.available and a.version != doc.version
         ]
         if availables and self.availabilities[-1].available:
-            prev_version = availables[-1]
-            obsoletes = set(
-                p.sub_id
-                for p in self.exposed_and_hidden
-                if prev_version in p.exposed_versions
-            ) - set(p.sub_id for p in doc.iter_parts())
-            for sub_id in obsoletes:
-                part = latest_loaded.get(sub_id)
-                if part.abstract.in_force is False and part.abstract.is_latest is False:
+            new_sub_ids = set(p.sub_id for p in doc.iter_parts())
+            for sub_id, eh in self.entries(availables[-1]).items():
+                if sub_id not in new_sub_ids:
+                    bulk.update(self.global_id(eh), in_force=False, is_latest=False)
+        self._log_changes(self._available_from(len(self.availabilities) - 1))
+
+    def _insert(
+        self, doc: DocumentVersion, bulk: BulkActions, position, previous, following
+    ):
+        """Incorporates a version in between the existing ones. Each part that
+        is identical to the one of the previous or the following version
+        is just exposed for this version as well. Only the parts that differ
+        from both are indexed, as neither latest nor in force. The flags of
+        the already indexed parts remain valid. A part shared with the
+        following version is stored under this version from now on, since
+        the hidden version is the earliest exposing it (cf. _rehide).
+        """
+        if doc.version in {a.version for a in self.availabilities}:
+            raise InconsistentVersionHistory(
+                f"Version {doc.version} already available "
+                f"for {self.domain}-{self.id_local}."
+            )
+        self.availabilities.insert(
+            position,
+            dm.VersionAvailability(
+                version=doc.version,
+                date_document=doc.date_document,
+                available=doc.available,
+                source_hash=doc.source_hash,
+            ),
+        )
+        dates = self.version_to_date
+        moves = {}
+        for new_part in doc.iter_parts():
+            if new_part.fingerprint is None:
+                new_part.fingerprint = new_part.compute_fingerprint()
+            for neighbour in (previous, following):
+                entry = neighbour.get(new_part.sub_id)
+                if entry is None or entry.fingerprint != new_part.fingerprint:
                     continue
-                part.abstract.in_force = False
-                part.abstract.is_latest = False
-                part.save()
-        self.save()
+                if dates[entry.hidden_version] > doc.date_document:
+                    moves[self.global_id(entry)] = entry
+                    entry.hidden_version = doc.version
+                    entry.exposed_versions.insert(0, doc.version)
+                else:
+                    self._expose(entry, doc.version)
+                    if PART_VERSION_LABELS == "script":
+                        bulk.append_version(self.global_id(entry), doc.version)
+                break
+            else:
+                bulk.index(new_part)
+                if new_part.sub_id == "COV":
+                    bulk.update(new_part.meta.id, is_latest=False)
+                else:
+                    bulk.update(new_part.meta.id, is_latest=False, in_force=False)
+                self.exposed_and_hidden.append(
+                    dm.ExposedAndHiddenVersions(
+                        sub_id=new_part.sub_id,
+                        hidden_version=doc.version,
+                        exposed_versions=[doc.version],
+                        fingerprint=new_part.fingerprint,
+                    )
+                )
+        self._rehide(moves, bulk)
 
-    @flushed
+    _superseded = ()
+
+    def _rehide(self, moves: dict, bulk: BulkActions):
+        """Indexes ES-documents anew under the ID of their entry's changed
+        hidden version (cf. global_id). <moves> maps their current IDs to the
+        entries. The documents under the current IDs are superseded. They are
+        only deleted once the version map is saved (cf. _delete_superseded),
+        so that a failed write leaves the stored map's documents intact.
+        """
+        for id_, part in dm.get_many(moves).items():
+            eh = moves[id_]
+            part.meta.id = self.global_id(eh)
+            if PART_VERSION_LABELS == "script":
+                part.abstract.version = list(eh.exposed_versions)
+            else:
+                part.abstract.version = [eh.hidden_version]
+            bulk.index(part)
+        self._superseded = (*self._superseded, *moves)
+
+    def _delete_superseded(self):
+        if not self._superseded:
+            return
+        bulk = BulkActions()
+        for id_ in self._superseded:
+            bulk.delete(id_)
+        self._superseded = ()
+        with phase("bulk"):
+            bulk.commit()
+
+    @refresh.refreshed
     def insert_unavailable(self, version, date_document, after=None):
         """If after is omitted, it shall just include this in behind the latest
         version.
@@ -290,36 +645,79 @@ class DocumentHistory(dm.VersionsMap):
                     version=version, date_document=date_document, available=False
                 ),
             )
+        self.changed()
         self.save()
 
-    @flushed
     def remove_latest(self):
-        """Removes given version from the index and
+        """Removes the latest version from the index and
         updates the VersionsMap instance correspondingly."""
-        # TODO: fix: is_latest, Article.abstract.version (per article), in_force
-        latest = self.availabilities.pop()
+        self.remove_version(self.availabilities[-1].version)
+
+    @refresh.refreshed
+    def remove_version(self, version):
+        """Removes the given version from the index and the VersionsMap.
+        Its own ES-documents are deleted, the others lose its version label.
+        If it was the last version, the previous version's ES-documents are
+        flagged as latest again and obtain the in_force value of its cover.
+        All of that is written with one bulk request.
+        """
+        position = [a.version for a in self.availabilities].index(version)
+        self.availabilities.pop(position)
         if len(self.availabilities) == 0:
             return self.purge()
+        bulk = BulkActions()
         removables = []
+        moves = {}
         for k, eh in enumerate(self.exposed_and_hidden):
-            if eh.exposed_versions == [latest.version]:
+            if eh.exposed_versions == [version]:
                 removables.append(k)
-                try:
-                    dm.delete(
-                        "-".join(
-                            (self.domain, self.id_local, eh.sub_id, latest.version)
-                        )
-                    )
-                except NotFoundError:
-                    # seems like this document was not actually loaded
-                    pass
-            elif eh.exposed_versions[-1] == latest.version:
-                eh.exposed_versions.pop()
+                bulk.delete(self.global_id(eh))
+            elif eh.hidden_version == version:
+                # Shared with later versions, e.g. as inserted (cf. _insert)
+                moves[self.global_id(eh)] = eh
+                eh.exposed_versions.remove(version)
+                eh.hidden_version = eh.exposed_versions[0]
+            elif version in eh.exposed_versions:
+                # Not necessarily the last one, cf. _expose
+                eh.exposed_versions.remove(version)
+                if PART_VERSION_LABELS == "script":
+                    bulk.remove_version(self.global_id(eh), version)
         for k in sorted(removables, reverse=True):
             self.exposed_and_hidden.pop(k)
+        self._rehide(moves, bulk)
+        self.changed()
+        self.change_log = [c for c in self.change_log if c.version != version]
+        self._log_changes(self._available_from(position))
+        if position == len(self.availabilities):
+            self._restore_flags(bulk)
+        bulk.commit()
         self.save()
+        self._delete_superseded()
+
+    def _restore_flags(self, bulk: BulkActions):
+        """Flags of the parts of the now latest (available) version,
+        cf. _incorporate.
+        """
+        latest_cover = self.entries(self.availabilities[-1].version).get("COV")
+        if latest_cover is not None:
+            bulk.update(self.global_id(latest_cover), is_latest=True)
+        latest_available = self.latest_available
+        if latest_available is None:
+            return
+        entries = self.entries(latest_available)
+        try:
+            in_force = dm.Cover.get(self.global_id(entries["COV"])).abstract.in_force
+        except (KeyError, NotFoundError):
+            in_force = None
+        for sub_id, eh in entries.items():
+            if sub_id == "COV":
+                continue
+            if in_force is None:
+                bulk.update(self.global_id(eh), is_latest=True)
+            else:
+                bulk.update(self.global_id(eh), is_latest=True, in_force=in_force)
 
-    @flushed
+    @refresh.refreshed
     def purge(self):
         """Removes all document versions from the index and
         then deletes the VersionMap instance."""
@@ -327,6 +725,7 @@ class DocumentHistory(dm.VersionsMap):
             "term", abstract__domain=self.domain
         ).delete()
         dm.delete(self.meta.id)
+        refresh.settle()
 
     def iter_atoms(self):
         s = (
@@ -339,11 +738,17 @@ class DocumentHistory(dm.VersionsMap):
 
     @property
     def in_force(self):
-        values = set(
-            hit.abstract.in_force
-            for hit in self.iter_atoms()
-            if self.latest_available in hit.abstract.version
-        )
+        """Aggregated over the latest available version's ES-documents,
+        without retrieving them.
+        """
+        latest_ids = list(self.sub_to_global_id(self.latest_available).values())
+        s = dm.Search().filter("ids", values=latest_ids).extra(size=0)
+        s.aggs.bucket("in_force", "terms", field="abstract.in_force")
+        s.aggs.bucket("unset", "missing", field="abstract.in_force")
+        aggregations = s.execute().aggregations
+        values = set(bool(bucket.key) for bucket in aggregations.in_force.buckets)
+        if aggregations.unset.doc_count:
+            values.add(None)
         if len(values) == 1:
             return values.pop()
         else:
@@ -353,24 +758,104 @@ class DocumentHistory(dm.VersionsMap):
             )
 
     @in_force.setter
-    @flushed
     def in_force(self, value):
-        @retry(ConnectionTimeout, 3, 30)
-        def set_in_force_for_id(did):
-            d = dm.GenericContentDocument.get(did)
-            if d.doc_type in dm.content_document_types:
-                if getattr(d.abstract, "in_force", None) == value:
-                    return
-                d.abstract.in_force = value
-                d.save()
-
-        ids = [
-            hit.meta.id
-            for hit in self.iter_atoms()
-            if (self.latest_available in hit.abstract.version) or not value
-        ]
-        for id_ in ids:
-            set_in_force_for_id(id_)
+        self.set_in_force(value)
+
+    IN_FORCE_SCRIPT = (
+        "if (ctx._source.abstract.in_force == params.value) { ctx.op = 'noop'; }"
+        " else { ctx._source.abstract.in_force = params.value; }"
+    )
+
+    @refresh.refreshed
+    def set_in_force(self, value, progress=None, interval=IN_FORCE_PROGRESS_INTERVAL):
+        """Sets the in_force flag of the latest available version's ES-documents,
+        or if value is False, of all versions. Only the flag is changed, by an
+        update by query. Up to IN_FORCE_WAIT_MAX ES-documents, the request
+        waits for it. Otherwise, it runs as task on the elasticsearch server,
+        polled at growing intervals of up to <interval> seconds. Meanwhile,
+        progress(done, total) is called.
+        ES-documents changed concurrently are skipped and the update is run
+        again, up to IN_FORCE_ATTEMPTS times.
+        Returns the number of updated ES-documents.
+        """
+        s = (
+            dm.Search()
+            .filter("terms", doc_type=dm.content_document_types)
+            .filter("term", abstract__id_local=self.id_local)
+            .filter("term", abstract__domain=self.domain)
+        )
+        if value:
+            latest_ids = list(self.sub_to_global_id(self.latest_available).values())
+            s = s.filter("ids", values=latest_ids)
+        size = len(latest_ids) if value else len(self.exposed_and_hidden)
+        body = {
+            "query": s.to_dict()["query"],
+            "script": {
+                "source": self.IN_FORCE_SCRIPT,
+                "lang": "painless",
+                "params": {"value": value},
+            },
+        }
+        if progress is None:
+
+            def progress(done, total):
+                logger.info(f"in_force of {self.meta.id}: {done} of {total} done")
+
+        updated = 0
+        for attempt in range(IN_FORCE_ATTEMPTS):
+            if attempt:
+                dm.index.refresh()  # so that the changed ES-documents are found
+            response = self._update_by_query(
+                body, size <= IN_FORCE_WAIT_MAX, progress, interval
+            )
+            updated += response["updated"]
+            progress(response["updated"] + response["noops"], response["total"])
+            if not response["version_conflicts"]:
+                break
+            logger.warning(
+                f"in_force of {self.meta.id}: "
+                f"{response['version_conflicts']} version conflicts."
+            )
+        else:
+            raise RuntimeError(
+                f"Setting in_force of {self.meta.id} failed: "
+                f"ES-documents changed concurrently in each attempt."
+            )
+        refresh.settle()
+        return updated
+
+    def _update_by_query(self, body, wait, progress, interval) -> dict:
+        es = connections.get_connection()
+        if wait:
+            response = es.update_by_query(
+                index=dm.index_name, body=body, conflicts="proceed"
+            )
+        else:
+            task = es.update_by_query(
+                index=dm.index_name,
+                body=body,
+                conflicts="proceed",
+                wait_for_completion=False,
+            )["task"]
+            delay = min(0.1, interval)
+            while True:
+                status = es.tasks.get(task_id=task)
+                if status["completed"]:
+                    break
+                figures = status["task"]["status"]
+                progress(figures["updated"] + figures["noops"], figures["total"])
+                sleep(delay)
+                delay = min(2 * delay, interval)
+            if status.get("error"):
+                raise RuntimeError(
+                    f"Setting in_force of {self.meta.id} failed: {status['error']}"
+                )
+            response = status["response"]
+        if response.get("failures"):
+            raise RuntimeError(
+                f"Setting in_force of {self.meta.id} failed: {response['failures']}"
+            )
+        return response
 
     def sub_id_change(self, version):
         """Iterates over every article, indicating, whether it was
@@ -378,7 +863,64 @@ class DocumentHistory(dm.VersionsMap):
          - changed 'update'
          - removed 'delete'
         with respect to the previous version.
+        Read from the change log. Versions incorporated before the change
+        log was introduced are derived from the entries.
+        """
+        logged = self.logged_changes(version)
+        if logged is None:
+            yield from self._derive_sub_id_change(version)
+            return
+        for item in logged.changes:
+            yield item.sub_id, item.transaction
+
+    def toc_changed(self, version) -> bool:
+        logged = self.logged_changes(version)
+        if logged is None:
+            return self._derive_toc_changed(version)
+        return logged.toc_changed
+
+    def logged_changes(self, version):
+        for logged in self.change_log:
+            if logged.version == version:
+                return logged
+
+    def _derive_toc_changed(self, version) -> bool:
+        availables = [a.version for a in self.availabilities if a.available]
+        position = availables.index(version)
+        if position == 0:
+            return True
+        index = self.version_index
+        return index.hidden_version("TOC", version) != index.hidden_version(
+            "TOC", availables[position - 1]
+        )
+
+    def _available_from(self, position):
+        """The first available version at or behind the given position."""
+        for availability in self.availabilities[position:]:
+            if availability.available:
+                return availability.version
+
+    def _log_changes(self, *versions):
+        """(Re-)logs the changes of the given available versions, skipping
+        None. The map needs to be up to date (cf. changed).
         """
+        versions = [v for v in dict.fromkeys(versions) if v is not None]
+        change_log = [c for c in self.change_log if c.version not in versions]
+        for version in versions:
+            change_log.append(
+                dm.VersionChanges(
+                    version=version,
+                    toc_changed=self._derive_toc_changed(version),
+                    changes=[
+                        dm.SubIdChange(sub_id=sub_id, transaction=transaction)
+                        for sub_id, transaction in self._derive_sub_id_change(version)
+                    ],
+                )
+            )
+        self.change_log = change_log
+
+    def _derive_sub_id_change(self, version):
+        """Cf. sub_id_change. Derived from the entries."""
         availables = [a.version for a in self.availabilities if a.available]
         if version not in availables:
             pass
@@ -392,7 +934,7 @@ class DocumentHistory(dm.VersionsMap):
                     yield eh.sub_id, "insert"
         else:
             prev = availables[availables.index(version) - 1]
-            e2h = self.exposed_to_hidden
+            index = self.version_index
             handleds = set()
             for eh in self.exposed_and_hidden:
                 if eh.sub_id in handleds:
@@ -400,8 +942,8 @@ class DocumentHistory(dm.VersionsMap):
                 handleds.add(eh.sub_id)
                 if not art_sub_id(eh.sub_id):
                     continue
-                hidden_vers = e2h.get((eh.sub_id, version))
-                hidden_prev = e2h.get((eh.sub_id, prev))
+                hidden_vers = index.hidden_version(eh.sub_id, version)
+                hidden_prev = index.hidden_version(eh.sub_id, prev)
                 if hidden_vers == hidden_prev:  # both None or both the same
                     continue
                 if hidden_vers is None:
@@ -0,0 +1,414 @@
+"""
+Persistent queue of uploaded documents and the workers incorporating them.
+The upload endpoint only enqueues the document and returns the job's ID.
+Parsing and writing to the index is done by a pool of worker processes,
+so that web workers serving readers never wait for an upload.
+
+The relations of an incorporated document to other documents are propagated
+by a follow-up job (cf. settings.INGEST_DEFER_BACKLINKS).
+
+Start the workers via:
+    python -m legislative_act.ingest [--workers N]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import sqlite3
+from contextlib import closing, contextmanager, nullcontext
+from datetime import datetime, timedelta
+from time import sleep
+
+from elasticsearch.exceptions import ConnectionTimeout, NotFoundError
+
+from . import model as dm
+from .backlinks import propagate
+from .history import (
+    DocumentHistory,
+    DocumentVersion,
+    InconsistentVersionHistory,
+    source_hash,
+)
+from .instrumentation import label, phase, recording
+from .receiver import DocumentReceiver
+from settings import (
+    INGEST_QUEUE_PATH,
+    INGEST_WORKERS,
+    INGEST_POLL_INTERVAL,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_RETRY_DELAY,
+    INGEST_DEFER_BACKLINKS,
+)
+
+logger = logging.getLogger(__name__)
+# One JSON line per job, with the time and requests per phase:
+metrics_logger = logging.getLogger(f"{__name__}.metrics")
+
+
+class IngestError(Exception):
+    """The uploaded document cannot be incorporated. No retry."""
+
+
+class IngestQueue:
+    """Job table in an SQLite database. Each access opens its own connection,
+    so that an instance can be shared between threads and processes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'upload',
+            source TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created TEXT NOT NULL,
+            not_before TEXT NOT NULL,
+            started TEXT,
+            finished TEXT,
+            metrics TEXT
+        );
+        CREATE INDEX IF NOT EXISTS job_pending ON job (status, not_before, id);
+        CREATE TABLE IF NOT EXISTS document_lock (
+            document TEXT PRIMARY KEY,
+            acquired TEXT NOT NULL
+        );
+    """
+
+    status_fields = (
+        "id",
+        "domain",
+        "kind",
+        "status",
+        "message",
+        "attempts",
+        "created",
+        "started",
+        "finished",
+        "metrics",
+    )
+
+    def __init__(self, path=INGEST_QUEUE_PATH):
+        self.path = path
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(job)")]
+            if "metrics" not in columns:  # queue created by a former release
+                connection.execute("ALTER TABLE job ADD COLUMN metrics TEXT")
+
+    def _connect(self):
+        # autocommit mode; transactions are opened explicitly
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _now(delay=0) -> str:
+        return (datetime.now() + timedelta(seconds=delay)).isoformat(timespec="seconds")
+
+    def enqueue(self, domain: str, source: str, kind="upload") -> int:
+        """<kind> is either "upload" of a single document,
+        "backfill", with <source> being a JSON list of documents, or
+        "backlinks", with <source> being a JSON list of cover IDs.
+        """
+        now = self._now()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT INTO job (domain, kind, source, created, not_before)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (domain, kind, source, now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self):
+        """Marks the oldest due job as running and returns
+        the tuple (job_id, domain, kind, source), or None if there is none.
+        """
+        with closing(self._connect()) as connection:
+            # The write lock is acquired right away,
+            # so that no job is claimed twice.
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id, domain, kind, source FROM job"
+                " WHERE status = 'queued' AND not_before <= ?"
+                " ORDER BY id LIMIT 1",
+                (self._now(),),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE job SET status = 'running', started = ?,"
+                    " attempts = attempts + 1 WHERE id = ?",
+                    (self._now(), row[0]),
+                )
+            connection.execute("COMMIT")
+        return row
+
+    def finish(self, job_id: int, message: str, metrics: dict = None):
+        """<metrics>: Cf. instrumentation.Recording.to_dict"""
+        self._close(job_id, "done", message, metrics)
+
+    def fail(self, job_id: int, message: str, metrics: dict = None):
+        self._close(job_id, "failed", message, metrics)
+
+    def _close(self, job_id, status, message, metrics=None):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE job SET status = ?, message = ?, finished = ?,"
+                " metrics = ?, source = NULL WHERE id = ?",
+                (
+                    status,
+                    message,
+                    self._now(),
+                    None if metrics is None else json.dumps(metrics),
+                    job_id,
+                ),
+            )
+
+    def retry(self, job_id: int, message: str, delay=INGEST_RETRY_DELAY):
+        """Puts the job back into the queue, unless
+        it has been attempted INGEST_MAX_ATTEMPTS times.
+        """
+        with closing(self._connect()) as connection:
+            (attempts,) = connection.execute(
+                "SELECT attempts FROM job WHERE id = ?", (job_id,)
+            ).fetchone()
+        if attempts >= INGEST_MAX_ATTEMPTS:
+            self.fail(job_id, message)
+            return
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE job SET status = 'queued', message = ?, not_before = ?"
+                " WHERE id = ?",
+                (message, self._now(delay), job_id),
+            )
+
+    def requeue_running(self) -> int:
+        """Jobs that were running when the workers stopped are queued again.
+        Their document locks are released.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM document_lock")
+            return connection.execute(
+                "UPDATE job SET status = 'queued' WHERE status = 'running'"
+            ).rowcount
+
+    def lock(self, document: str) -> bool:
+        """Returns False if the document is locked already."""
+        with closing(self._connect()) as connection:
+            return (
+                connection.execute(
+                    "INSERT OR IGNORE INTO document_lock (document, acquired)"
+                    " VALUES (?, ?)",
+                    (document, self._now()),
+                ).rowcount
+                == 1
+            )
+
+    def unlock(self, document: str):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "DELETE FROM document_lock WHERE document = ?", (document,)
+            )
+
+    @contextmanager
+    def locked(self, document: str, poll_interval=INGEST_POLL_INTERVAL):
+        """Versions of the same document are incorporated one after another,
+        while different documents are incorporated by the workers in parallel.
+        """
+        while not self.lock(document):
+            sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self.unlock(document)
+
+    def status(self, job_id: int):
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(self.status_fields)} FROM job WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        result = dict(zip(self.status_fields, row))
+        if result["metrics"] is not None:
+            result["metrics"] = json.loads(result["metrics"])
+        return result
+
+
+def document_lock(queue: IngestQueue, domain: str, id_local: str):
+    """Without a queue, i.e. when not called by a worker, nothing is locked."""
+    if queue is None:
+        return nullcontext()
+    return queue.locked(f"{domain}-{id_local}")
+
+
+def defer_backlinks(queue: IngestQueue, domain: str, docs: list):
+    """Queues the IDs of the covers of the given versions of one document,
+    as indexed: An unchanged cover is not indexed again, but exposed for
+    the new version on the cover of a previous one.
+    """
+    history = docs[0].find_history()
+    index = history.version_index
+    cover_ids = dict.fromkeys(
+        history.global_id(eh)
+        for eh in (index.entry("COV", doc.version) for doc in docs)
+        if eh is not None
+    )
+    queue.enqueue(domain, json.dumps(list(cover_ids)), "backlinks")
+
+
+def incorporate(
+    domain: str, source: str, queue: IngestQueue = None, deferral: IngestQueue = None
+) -> str:
+    """The document is locked on the worker's <queue> while it is written.
+    If a <deferral> queue is given, the relations to other documents
+    are propagated by a follow-up job on that queue.
+    A repeated upload of the same source document is not parsed again.
+    """
+    with phase("find_upload"):
+        present = DocumentHistory.find_upload(source_hash(source))
+    if present is not None:
+        return f"Already present at {present}"
+    dr = DocumentReceiver.relaxed_instantiation(source)
+    if domain != dr.domain:
+        raise IngestError("Inconsistent document domain")
+    label(document=f"/{domain}/{dr.id_local}/{dr.version}")
+    with document_lock(queue, domain, dr.id_local):
+        try:
+            dr.save(backlinks=deferral is None)
+        except InconsistentVersionHistory as e:
+            # Raised before anything is written. So, nothing to roll back.
+            raise IngestError(str(e))
+        except Exception:
+            logger.error(f"Failed to load /{domain}/{dr.id_local}/{dr.version}")
+            try:
+                dh = DocumentHistory.get(f"{domain}-{dr.id_local}")
+            except NotFoundError:
+                pass
+            else:
+                if dr.version in {a.version for a in dh.availabilities}:
+                    dh.remove_version(dr.version)
+            raise
+    if deferral is not None:
+        defer_backlinks(deferral, domain, [dr])
+    return f"Uploaded to /{domain}/{dr.id_local}/{dr.version}"
+
+
+def backfill(
+    domain: str, sources: list, queue: IngestQueue = None, deferral: IngestQueue = None
+) -> str:
+    """Cf. incorporate"""
+    with phase("find_upload"):
+        sources = [
+            source
+            for source in sources
+            if DocumentHistory.find_upload(source_hash(source)) is None
+        ]
+    if not sources:
+        return "Already present"
+    docs = [DocumentReceiver.relaxed_instantiation(source) for source in sources]
+    if any(doc.domain != domain for doc in docs):
+        raise IngestError("Inconsistent document domain")
+    label(document=f"/{domain}/{docs[0].id_local}/", versions=len(docs))
+    with document_lock(queue, domain, docs[0].id_local):
+        DocumentVersion.save_all(docs, backlinks=deferral is None)
+    if deferral is not None:
+        defer_backlinks(deferral, domain, docs)
+    doc = docs[0]
+    return f"Uploaded {len(docs)} versions to /{domain}/{doc.id_local}/"
+
+
+def dry_run(domain: str, source: str, histories: dict = None) -> dict:
+    """Change set that uploading the document would yield, without writing.
+    Cf. DocumentHistory.changes. Over several calls, the version maps
+    may be cached in <histories>, by ID.
+    """
+    dr = DocumentReceiver.relaxed_instantiation(source)
+    if domain != dr.domain:
+        raise IngestError("Inconsistent document domain")
+    history = None
+    if histories is not None:
+        key = f"{dr.domain}-{dr.id_local}"
+        if key not in histories:
+            histories[key] = dr.find_history()
+        history = histories[key]
+    return {
+        "document": f"/{domain}/{dr.id_local}/{dr.version}",
+        **dr.changes(history),
+    }
+
+
+def backlinks(cover_ids: list) -> str:
+    updated = propagate(dm.get_many(cover_ids, missing="skip").values())
+    return f"Propagated relations to {updated} document(s)"
+
+
+def process(queue: IngestQueue, job) -> None:
+    """The job's metrics (cf. instrumentation) are stored along with its
+    status and logged as one JSON line.
+    """
+    job_id, domain, kind, source = job
+    deferral = queue if INGEST_DEFER_BACKLINKS else None
+    with recording() as record:
+        try:
+            if kind == "backlinks":
+                message = backlinks(json.loads(source))
+            elif kind == "backfill":
+                message = backfill(domain, json.loads(source), queue, deferral)
+            else:
+                message = incorporate(domain, source, queue, deferral)
+        except ConnectionTimeout as e:
+            logger.warning(f"Ingest job {job_id} timed out. Retrying later.")
+            status, message = "retry", f"Timeout: {e}"
+        except IngestError as e:
+            status, message = "failed", str(e)
+        except Exception as e:
+            logger.error(f"Ingest job {job_id} failed.", exc_info=True)
+            status, message = "failed", f"{type(e).__name__}: {e}"
+        else:
+            status = "done"
+    metrics = record.to_dict()
+    metrics_logger.info(
+        json.dumps({"job": job_id, "kind": kind, "status": status, **metrics})
+    )
+    if status == "retry":
+        queue.retry(job_id, message)
+    elif status == "failed":
+        queue.fail(job_id, message, metrics)
+    else:
+        queue.finish(job_id, message, metrics)
+
+
+def work(path=INGEST_QUEUE_PATH, poll_interval=INGEST_POLL_INTERVAL, stop=None):
+    """Processes the queue's jobs one after another, until <stop> is set."""
+    queue = IngestQueue(path)
+    while stop is None or not stop.is_set():
+        job = queue.claim()
+        if job is None:
+            sleep(poll_interval)
+            continue
+        process(queue, job)
+
+
+def run_workers(workers=INGEST_WORKERS, path=INGEST_QUEUE_PATH):
+    queue = IngestQueue(path)
+    requeued = queue.requeue_running()
+    if requeued:
+        logger.warning(f"Requeued {requeued} interrupted ingest job(s).")
+    processes = [
+        multiprocessing.Process(target=work, args=(path,), name=f"ingest-{i}")
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the ingest workers.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--queue", default=INGEST_QUEUE_PATH)
+    arguments = parser.parse_args()
+    run_workers(arguments.workers, arguments.queue)
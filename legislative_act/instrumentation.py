@@ -0,0 +1,104 @@
+"""
+Measurements of an ingest, per phase: wall time, number of requests to
+elasticsearch and bytes sent to it. Usage:
+    with recording() as record:
+        with phase("parse"):
+            ...
+    record.to_dict()
+    -> {"seconds": 0.3, "phases": {"parse": {"seconds": 0.2, ...}, ...}}
+The figures of a phase exclude those of the phases nested in it, so
+that they add up. Outside of recording(), phase() does not record anything.
+The requests are counted by the connection class (cf. model.py).
+"""
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from elasticsearch import Urllib3HttpConnection
+
+_local = threading.local()
+
+
+class Recording:
+    def __init__(self):
+        self.labels = {}
+        self.phases = {}
+        self.stack = []
+        self.seconds = 0.0
+
+    def figures(self, name) -> dict:
+        if name not in self.phases:
+            self.phases[name] = {"seconds": 0.0, "es_calls": 0, "es_bytes": 0}
+        return self.phases[name]
+
+    def to_dict(self) -> dict:
+        return {
+            **self.labels,
+            "seconds": round(self.seconds, 4),
+            "phases": {
+                name: {**figures, "seconds": round(figures["seconds"], 4)}
+                for name, figures in self.phases.items()
+            },
+        }
+
+
+def current():
+    return getattr(_local, "recording", None)
+
+
+@contextmanager
+def recording():
+    """Records the phases within, in this thread.
+    An enclosing recording is suspended meanwhile.
+    """
+    enclosing = current()
+    _local.recording = result = Recording()
+    start = perf_counter()
+    try:
+        yield result
+    finally:
+        result.seconds = perf_counter() - start
+        _local.recording = enclosing
+
+
+@contextmanager
+def phase(name):
+    record = current()
+    if record is None:
+        yield
+        return
+    figures = record.figures(name)
+    record.stack.append(figures)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        record.stack.pop()
+        figures["seconds"] += elapsed
+        if record.stack:
+            record.stack[-1]["seconds"] -= elapsed
+
+
+def label(**labels):
+    """Adds information to the current recording, e.g. the document."""
+    record = current()
+    if record is not None:
+        record.labels.update(labels)
+
+
+def count_request(body):
+    record = current()
+    if record is None:
+        return
+    figures = record.stack[-1] if record.stack else record.figures("other")
+    figures["es_calls"] += 1
+    figures["es_bytes"] += len(body or b"")
+
+
+class CountingConnection(Urllib3HttpConnection):
+    """Counts the requests and the bytes sent for the current recording."""
+
+    def perform_request(self, method, url, params=None, body=None, *args, **kwargs):
+        count_request(body)
+        return super().perform_request(method, url, params, body, *args, **kwargs)
@@ -0,0 +1,145 @@
+"""
+Reference implementation of the metadata extraction from the RDFa data of
+uploaded documents, based on rdflib and SPARQL queries.
+For production use, cf. the single-pass extractor in rdfa.py.
+"""
+import re
+from collections import defaultdict
+
+from lxml import etree as et
+from rdflib import Graph, URIRef, Namespace, RDF, Literal, XSD
+
+from .utils.generics import ignore_void_dict
+from . import model as dm
+from settings import DEFAULT_IRI
+
+
+class LexGraph(Graph):
+
+    custom_namespace = {
+        "eli": Namespace("http://data.europa.eu/eli/ontology#"),
+        "lxp": Namespace("http://lexparency.org/ontology#"),
+    }
+
+    referral_types = list(dm.Cover.iter_anchors())
+
+    relevant_prefixes = re.compile(
+        "^(?P<prefix>{})".format("|".join(custom_namespace.values()))
+        + "(?P<predicate>.+)"
+    )
+
+    def __init__(self, document: et.ElementBase):
+        super().__init__()
+        for pair in self.custom_namespace:
+            self.bind(*pair)
+        self._refs = set()
+        self._parse(document)
+
+    def add_ref(self, ref: str):
+        if ref.startswith("/"):
+            ref = DEFAULT_IRI + ref
+        ref = URIRef(ref)
+        if ref not in self._refs:
+            self._refs.add(ref)
+            self.add((ref, RDF.type, self.custom_namespace["eli"].Work))
+        return ref
+
+    def _parse(self, document: et.ElementBase):
+        this = self.add_ref(DEFAULT_IRI)
+        for meta in document.xpath(".//meta[@property] | .//span[@property]"):
+            attribs = meta.attrib
+            namespace, verb = attribs["property"].split(":")
+            predicate = self.custom_namespace[namespace][verb]
+            if attribs.get("datatype", "").startswith("xsd:"):
+                datatype = attribs["datatype"].split(":", 1)[1]
+                value = Literal(attribs["content"], datatype=XSD[datatype])
+            elif attribs.get("lang"):
+                value = Literal(attribs["content"], lang=attribs["lang"])
+            elif "resource" in attribs:
+                value = self.add_ref(attribs["resource"])
+            else:
+                value = Literal(attribs["content"])
+            if "about" in attribs:
+                subject = self.add_ref(attribs["about"])
+            else:
+                subject = this
+            self.add((subject, predicate, value))
+
+    @property
+    def query_prefix(self):
+        return "\n".join(
+            f"PREFIX {key}: <{value}>" for key, value in self.custom_namespace.items()
+        )
+
+    def query(self, query, *args, **kwargs):
+        return super().query(self.query_prefix + "\n" + query, *args, **kwargs)
+
+    @property
+    def date_document(self):
+        result = self.query(
+            f"""
+                SELECT ?o
+                WHERE {{
+                    <{DEFAULT_IRI}> eli:date_document ?o .
+                    FILTER(isLiteral(?o))
+                }}
+            """
+        )
+        for (o,) in result:
+            return o.toPython()
+
+    def plain_predicates(self) -> dict:
+        result = self.query(
+            f"""
+                SELECT ?p ?o
+                WHERE {{
+                    <{DEFAULT_IRI}> ?p ?o .
+                    FILTER(isLiteral(?o))
+                }}
+            """
+        )
+        outcome = defaultdict(list)
+        for p, o in result:
+            m = self.relevant_prefixes.match(p)
+            if m is None:
+                continue
+            outcome[m.group("predicate")].append(o.toPython())
+        return outcome
+
+    def iter_anchors(self):
+        def implemented(v, r_type):
+            if v is None:
+                if r_type in dm.Anchor.changers:
+                    return False  # is the default for referrers
+                return
+            return v.toPython() == DEFAULT_IRI
+
+        for referral_type in self.referral_types:
+            query_result = self.query(
+                f"""
+                    SELECT ?href ?title ?text ?v
+                    WHERE {{
+                        <{DEFAULT_IRI}> eli:{referral_type} ?href .
+                        ?href lxp:id_human ?text .
+                        OPTIONAL {{
+                            ?href eli:title ?title .
+                        }}
+                        OPTIONAL {{
+                            ?v lxp:version_implements ?href .
+                        }}
+                    }}
+                """
+            )
+            if not query_result:
+                continue
+            yield referral_type, [
+                dm.Anchor(
+                    **ignore_void_dict(
+                        href=href.toPython(),
+                        text=text.toPython() if text is not None else None,
+                        title=title.toPython() if title is not None else None,
+                        implemented=implemented(v, referral_type),
+                    )
+                )
+                for href, title, text, v in query_result
+            ]
@@ -14,10 +14,13 @@ the class. Therefore note the following
 from __future__ import annotations
 from collections import defaultdict
 from functools import partial, lru_cache
+from hashlib import sha1
 from itertools import product
+from typing import Optional
 import datetime
+import json
 
-from elasticsearch import ConnectionTimeout
+from elasticsearch import ConnectionTimeout, NotFoundError
 from elasticsearch_dsl import (
     Document,
     Date,
@@ -40,9 +43,12 @@ from elasticsearch_dsl.document import IndexMeta
 
 from legislative_act.utils.generics import get_today, retry
 from .es_settings import numbers, create_analysis
-from settings import LANG_2, DEFAULT_IRI, ES_CONNECTION
+from .instrumentation import CountingConnection
+from settings import LANG_2, DEFAULT_IRI, ES_CONNECTION, MGET_CHUNK_SIZE
 
-connections.create_connection(hosts=[ES_CONNECTION])
+connections.create_connection(
+    hosts=[ES_CONNECTION], connection_class=CountingConnection
+)
 
 language = LANG_2
 index_name = f"legex-{language}"
@@ -72,6 +78,25 @@ class AutoInspector(ObjectBase):
         return cls._doc_type.mapping.to_dict()["properties"].keys()
 
 
+def normalized(value):
+    """Brings an ES-document's dictionary into the form in which it is
+    compared, for the purpose of content fingerprints:
+    Twix-fields are reduced to their stripped text, and datetime values
+    at midnight are considered as dates.
+    """
+    if type(value) is dict:
+        if set(value.keys()) == {"stripped", "dressed"}:
+            return value["stripped"]
+        return {key: normalized(item) for key, item in value.items()}
+    if type(value) is list:
+        return [normalized(item) for item in value]
+    if type(value) is datetime.datetime and value.time() == datetime.time(0, 0):
+        return value.date().isoformat()
+    if type(value) in (datetime.date, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
 def art_sub_id(sub_id):
     """Checks whether the sub_id <sub_id> could come from an article."""
     return sub_id not in ("COV", "TOC", "PRE") and not sub_id.startswith("DEF_")
@@ -87,6 +112,18 @@ class Document(Document):
             "_source": self.to_dict(),
         }
 
+    def as_action(self) -> dict:
+        """Index-action, as expected by the bulk helpers of elasticsearch.
+        Corresponds to what save() would send to the index.
+        """
+        self.full_clean()
+        return {
+            "_op_type": "index",
+            "_index": index_name,
+            "_id": self.meta.id,
+            "_source": self.to_dict(skip_empty=True),
+        }
+
     @classmethod
     @retry(ConnectionTimeout, 3, 10)
     def get(cls, *args, **kwargs) -> VersionsMap:
@@ -181,6 +218,8 @@ class Base(Document):
     doc_type = Keyword(required=True)
     abstract = Object(Abstract)
     score_multiplier = Integer()  # For better controlled search-ranking
+    # Hash of the content, as it is relevant for comparison of versions:
+    fingerprint = Keyword(index=False)
 
     @classmethod
     def get_doc_type(cls):
@@ -210,6 +249,26 @@ class Base(Document):
         # make sure they never get used for deserialization
         return False
 
+    def fingerprint_content(self) -> dict:
+        """The part of the document's content that is covered by the
+        fingerprint. Corresponds to what is compared via __eq__.
+        """
+        result = self.to_dict()
+        result.pop("fingerprint", None)
+        abstract = result.pop("abstract", {})
+        result["abstract"] = {
+            name: abstract.get(name)
+            for name in ("domain", "id_local", "type_document", "serial_number")
+        }
+        return normalized(result)
+
+    def compute_fingerprint(self) -> str:
+        return sha1(
+            json.dumps(
+                self.fingerprint_content(), sort_keys=True, ensure_ascii=False
+            ).encode("utf-8")
+        ).hexdigest()
+
     def flat_dict(self) -> dict:
         """
         Provide a dictionary without all the Twix and Nested fuzz.
@@ -235,6 +294,7 @@ class Base(Document):
                             flatten(item)
 
         result = self.to_dict()
+        result.pop("fingerprint", None)
         flatten(result)
         abstract = result.pop("abstract")
         result.update(abstract)
@@ -246,6 +306,8 @@ class VersionAvailability(InnerDoc):
     date_document = Date(required=True)  # eli:date_document
     available = Boolean(required=True)
     date_received = Date(required=True)
+    # sha1 of the uploaded source document, to recognize repeated uploads:
+    source_hash = Keyword()
 
     def __init__(self, **kwargs):
         if "date_received" not in kwargs:
@@ -262,6 +324,71 @@ class ExposedAndHiddenVersions(InnerDoc):
     # versions list for which hidden_version serves as resource.
     # Contains value of "hidden_version" as first item.
     exposed_versions = Keyword(required=True, multi=True)
+    # Fingerprint of the ES-document (cf. Base.fingerprint):
+    fingerprint = Keyword(index=False)
+
+
+class SubIdChange(InnerDoc):
+    sub_id = Keyword(required=True)
+    transaction = Keyword(required=True)  # "insert", "update", or "delete"
+
+
+class VersionChanges(InnerDoc):
+    """Changes of the articles of an available version with respect to the
+    previous available version, logged at ingest (cf. history.sub_id_change).
+    """
+
+    version = Keyword(required=True)
+    toc_changed = Boolean()
+    changes = Object(SubIdChange, multi=True)
+
+
+class VersionIndex:
+    """Lookups in a VersionsMap without scanning its entries. Per sub_id, a
+    dict maps the versions exposing the sub_id to the position of the entry.
+    The positions per version are only collected on their first lookup.
+    """
+
+    def __init__(self, vm: VersionsMap):
+        self.entries = list(vm.exposed_and_hidden)
+        self.order = {
+            v: i
+            for i, v in enumerate(dict.fromkeys(a.version for a in vm.availabilities))
+        }
+        self.positions = defaultdict(dict)
+        for position, eh in enumerate(self.entries):
+            for version in eh.exposed_versions:
+                self.positions[eh.sub_id][version] = position
+        self._by_version = None
+
+    def entry(self, sub_id, version) -> Optional[ExposedAndHiddenVersions]:
+        position = self.positions.get(sub_id, {}).get(version)
+        return None if position is None else self.entries[position]
+
+    def hidden_version(self, sub_id, version) -> Optional[str]:
+        eh = self.entry(sub_id, version)
+        return None if eh is None else eh.hidden_version
+
+    def version_entries(self, version) -> dict:
+        """Maps each sub_id of the version to its entry,
+        in the order of the entries.
+        """
+        if self._by_version is None:
+            self._by_version = defaultdict(list)
+            for position, eh in enumerate(self.entries):
+                for v in eh.exposed_versions:
+                    self._by_version[v].append(position)
+        return {
+            self.entries[p].sub_id: self.entries[p]
+            for p in self._by_version.get(version, ())
+        }
+
+    def leaf_versions(self, sub_id) -> list:
+        """Versions in which the sub_id exists"""
+        return sorted(
+            self.positions.get(sub_id, ()),
+            key=lambda v: self.order.get(v, len(self.order)),
+        )
 
 
 def uniquify_list(inp):
@@ -281,6 +408,7 @@ def uniquify_list(inp):
 class VersionsMap(Document):
     availabilities = Nested(VersionAvailability)
     exposed_and_hidden = Nested(ExposedAndHiddenVersions)
+    change_log = Nested(VersionChanges)
     doc_type = Keyword(required=True)
 
     def datify(self):
@@ -311,11 +439,34 @@ class VersionsMap(Document):
         kwargs["doc_type"] = "versionsmap"
         super().__init__(**kwargs)
 
+    def save(self, **kwargs):
+        """Optimistic concurrency control: A map read from the index is only
+        written if it has not been changed meanwhile, i.e. if its seq_no and
+        primary_term are still the same. A new map is only written if there
+        is none yet. Otherwise, ConflictError is raised.
+        """
+        if "seq_no" not in self.meta:
+            kwargs.setdefault("op_type", "create")
+        return super().save(**kwargs)
+
     def __hash__(self):
         return id(self)
 
+    _version_index = None
+
+    @property
+    def version_index(self) -> VersionIndex:
+        """Built once. After altering the map, changed() needs to be called."""
+        if self._version_index is None:
+            self._version_index = VersionIndex(self)
+        return self._version_index
+
+    def changed(self):
+        self._version_index = None
+
     @property
     def exposed_to_hidden(self) -> dict:
+        """Rather use version_index.hidden_version"""
         return {
             (eh.sub_id, exposed_version): eh.hidden_version
             for eh in self.exposed_and_hidden
@@ -323,7 +474,6 @@ class VersionsMap(Document):
         }
 
     @property
-    @lru_cache()
     def hidden_to_exposed(self) -> dict:
         result = defaultdict(dict)
         for eh in self.exposed_and_hidden:
@@ -412,14 +562,16 @@ class Cover(Base, AutoInspector):
         result.update({back: forth for forth, back in list(result.items())})
         return result
 
-    def consist_relations(self):
+    def back_references(self) -> dict:
+        """Maps the id_local of each document of the same domain, that this
+        cover refers to, to the names of the fields that should refer back,
+        e.g. {"32013R0575": {"amended_by"}} if this document amends the CRR.
+        """
         # TODO: set "implemented" to "False" if relation in Anchors.changers
-        cls = type(self)
-        fba = cls.forth_back_anchors()
-        ia = self.as_anchor()
-        for ref_name in fba.keys():
-            anchors = getattr(self, ref_name)
-            for anchor in anchors:
+        fba = type(self).forth_back_anchors()
+        result = defaultdict(set)
+        for ref_name, back_name in fba.items():
+            for anchor in getattr(self, ref_name):
                 if not anchor.href.startswith(f"{DEFAULT_IRI}/"):
                     continue
                 rel_ref = anchor.href.replace(DEFAULT_IRI, "").strip("/")
@@ -428,19 +580,8 @@ class Cover(Base, AutoInspector):
                 domain, id_local, *_ = rel_ref.split("/")
                 if domain != self.abstract.domain:
                     continue
-                for hit in (
-                    Search()
-                    .filter("term", doc_type="cover")
-                    .filter("term", abstract__is_latest=True)
-                    .filter("term", abstract__id_local=id_local)
-                    .filter("term", abstract__domain=domain)
-                    .scan()
-                ):
-                    backs = set(a.href for a in getattr(hit, fba[ref_name], []))
-                    if ia.href not in backs:
-                        c = cls.get(hit.meta.id)
-                        getattr(c, fba[ref_name]).append(ia)
-                        c.save()
+                result[id_local].add(back_name)
+        return result
 
     def as_anchor(self) -> Anchor:
         return Anchor(
@@ -469,10 +610,25 @@ class Cover(Base, AutoInspector):
         self.uniquify_referrals()
         return super().save(**kwargs)
 
+    def as_action(self) -> dict:
+        assert getattr(self, "language", None) in (None, language.upper())
+        self.uniquify_referrals()
+        return super().as_action()
+
+    def fingerprint_content(self) -> dict:
+        """Order of the multi-valued fields does not matter for covers"""
+        result = super().fingerprint_content()
+        for name, value in result.items():
+            if type(value) is list:
+                result[name] = sorted(
+                    value, key=lambda x: json.dumps(x, sort_keys=True)
+                )
+        return result
+
     def __eq__(self, other) -> bool:
         if type(self) != type(other):
             return False
-        cover_fields = self.get_fields()
+        cover_fields = set(self.get_fields()) - {"fingerprint"}
         for name in cover_fields:
             left = getattr(self, name)
             right = getattr(other, name)
@@ -520,6 +676,10 @@ class Article(Base):  # A.k.a Article
     def __eq__(self, other):
         return self.heading == other.heading and self.body == other.body
 
+    def fingerprint_content(self) -> dict:
+        result = self.to_dict()
+        return normalized({key: result.get(key) for key in ("heading", "body")})
+
 
 class Recital(InnerDoc):
     # Field may also be used by other document types that have no real title
@@ -587,8 +747,57 @@ def delete(id_):
     GenericContentDocument.get(id=id_).delete()
 
 
+def part_class(sub_id):
+    """The document class of a document version's part"""
+    if sub_id.startswith("DEF_"):
+        return Definition
+    return {"COV": Cover, "TOC": ContentsTable, "PRE": Preamble}.get(sub_id, Article)
+
+
 content_document_types = [
     cls.__name__.lower()
     for cls in [eval(cl) for cl in dir() if type(eval(cl)) is IndexMeta]
     if issubclass(cls, Base) and cls is not Base
 ]
+
+doc_type_classes = {
+    cls.__name__.lower(): cls
+    for cls in (
+        VersionsMap,
+        Cover,
+        Article,
+        Preamble,
+        Definition,
+        ContentsTable,
+        NationalReference,
+    )
+}
+
+
+@retry(ConnectionTimeout, 3, 10)
+def _mget(ids: list) -> list:
+    return connections.get_connection().mget(body={"ids": ids}, index=index_name)[
+        "docs"
+    ]
+
+
+def get_many(ids, missing="raise") -> dict:
+    """Loads the ES-documents with given IDs via multi-get requests of
+    MGET_CHUNK_SIZE documents each. Each document is deserialized into the
+    class corresponding to its doc_type.
+    :param ids: iterable of document IDs
+    :param missing: "raise" to raise NotFoundError for any missing document,
+        "skip" to omit them from the result.
+    :return: dictionary {id: document}, in order of the given IDs.
+    """
+    ids = list(ids)
+    result = {}
+    for start in range(0, len(ids), MGET_CHUNK_SIZE):
+        for hit in _mget(ids[start : start + MGET_CHUNK_SIZE]):
+            if not hit["found"]:
+                if missing == "raise":
+                    raise NotFoundError(404, f"Document {hit['_id']} not found.")
+                continue
+            cls = doc_type_classes.get(hit["_source"].get("doc_type"))
+            result[hit["_id"]] = (cls or GenericContentDocument).from_es(hit)
+    return result
@@ -1,6 +1,6 @@
 from copy import deepcopy
 from datetime import date
-from functools import lru_cache, reduce
+from functools import lru_cache
 import re
 from html import escape
 
@@ -96,11 +96,6 @@ class DocumentProvider(Clearable):
     def current_is_available(self):
         return self.current == self.latest_available
 
-    @property
-    @lru_cache(maxsize=MAXSIZE)
-    def versions_map(self):
-        return self.history.exposed_to_hidden
-
     @lru_cache(maxsize=MAXSIZE)
     def get_versions_availability(self, sub_id):
         if sub_id == "TOC":
@@ -162,24 +157,15 @@ class DocumentProvider(Clearable):
         )
 
     def get_leaf_versions(self, sub_id):
-        try:
-            return reduce(
-                lambda a, b: list(a) + list(b),
-                self.history.hidden_to_exposed[sub_id].values(),
-                [],
-            )
-        except IndexError:
-            raise NotFoundError(", ".join((self.basic_error_msg, repr(sub_id))))
+        return self.history.version_index.leaf_versions(sub_id)
 
     def get_part_id(self, sub_id, version):
-        try:
-            return "-".join(
-                (self.base_id, sub_id, self.versions_map[(sub_id, version)])
-            )
-        except KeyError:
+        hidden_version = self.history.version_index.hidden_version(sub_id, version)
+        if hidden_version is None:
             raise NotFoundError(
                 ", ".join((self.basic_error_msg, repr(sub_id), repr(version)))
             )
+        return "-".join((self.base_id, sub_id, hidden_version))
 
     @lru_cache(maxsize=MAXSIZE)
     def get_article(self, sub_id, version) -> doc.Article:
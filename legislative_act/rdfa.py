@@ -0,0 +1,163 @@
+"""
+Extraction of the metadata from the RDFa data of uploaded documents.
+The meta- and span-elements carrying a property attribute are read in a
+single pass, without building an RDF graph. The result corresponds to the
+one of the SPARQL-based reference implementation lexgraph.LexGraph.
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from lxml import etree as et
+
+from .utils.generics import ignore_void_dict
+from . import model as dm
+from settings import DEFAULT_IRI
+
+
+def _boolean(lexical: str) -> bool:
+    return lexical.strip().lower() in ("true", "1")
+
+
+_xsd_converters = {
+    "string": str,
+    "boolean": _boolean,
+    "integer": int,
+    "int": int,
+    "long": int,
+    "decimal": Decimal,
+    "double": float,
+    "float": float,
+    "date": date.fromisoformat,
+    "dateTime": datetime.fromisoformat,
+}
+
+
+class Literal:
+    """Minimal counterpart of rdflib's Literal.
+    Equality follows lexical form, datatype and language.
+    """
+
+    __slots__ = ("lexical", "datatype", "lang")
+
+    def __init__(self, lexical, datatype=None, lang=None):
+        self.lexical = lexical
+        self.datatype = datatype
+        self.lang = lang
+
+    def _key(self):
+        return self.lexical, self.datatype, self.lang
+
+    def __eq__(self, other):
+        return type(other) is Literal and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def to_python(self):
+        converter = _xsd_converters.get(self.datatype)
+        if converter is None:
+            return self.lexical
+        try:
+            return converter(self.lexical)
+        except (ValueError, InvalidOperation):
+            return self.lexical
+
+
+class RDFaExtractor:
+
+    namespaces = ("eli", "lxp")
+
+    referral_types = list(dm.Cover.iter_anchors())
+
+    def __init__(self, document: et.ElementBase):
+        self.this = DEFAULT_IRI
+        # (subject, "namespace:predicate") -> objects in document order:
+        self._objects = defaultdict(dict)
+        self._parse(document)
+
+    @staticmethod
+    def ref(ref: str) -> str:
+        if ref.startswith("/"):
+            return DEFAULT_IRI + ref
+        return ref
+
+    def _parse(self, document: et.ElementBase):
+        for meta in document.xpath(".//meta[@property] | .//span[@property]"):
+            attribs = meta.attrib
+            namespace, verb = attribs["property"].split(":")
+            if namespace not in self.namespaces:
+                raise KeyError(namespace)
+            if attribs.get("datatype", "").startswith("xsd:"):
+                datatype = attribs["datatype"].split(":", 1)[1]
+                value = Literal(attribs["content"], datatype=datatype)
+            elif attribs.get("lang"):
+                value = Literal(attribs["content"], lang=attribs["lang"])
+            elif "resource" in attribs:
+                value = self.ref(attribs["resource"])
+            else:
+                value = Literal(attribs["content"])
+            if "about" in attribs:
+                subject = self.ref(attribs["about"])
+            else:
+                subject = self.this
+            # dictionary as ordered set, just like triples in a graph:
+            self._objects[(subject, f"{namespace}:{verb}")][value] = None
+
+    def objects(self, subject, predicate) -> list:
+        return list(self._objects.get((subject, predicate), ()))
+
+    @property
+    def date_document(self):
+        for o in self.objects(self.this, "eli:date_document"):
+            if type(o) is Literal:
+                return o.to_python()
+
+    def plain_predicates(self) -> dict:
+        outcome = defaultdict(list)
+        for (subject, predicate), objects in self._objects.items():
+            if subject != self.this:
+                continue
+            for o in objects:
+                if type(o) is Literal:
+                    outcome[predicate.split(":", 1)[1]].append(o.to_python())
+        return outcome
+
+    def implementers(self, ref: str) -> list:
+        return [
+            subject
+            for (subject, predicate), objects in self._objects.items()
+            if predicate == "lxp:version_implements" and ref in objects
+        ]
+
+    def iter_anchors(self):
+        def implemented(v, r_type):
+            if v is None:
+                if r_type in dm.Anchor.changers:
+                    return False  # is the default for referrers
+                return
+            return v == DEFAULT_IRI
+
+        def python(value):
+            if type(value) is Literal:
+                return value.to_python()
+            return value
+
+        for referral_type in self.referral_types:
+            anchors = [
+                dm.Anchor(
+                    **ignore_void_dict(
+                        href=href,
+                        text=python(text),
+                        title=python(title),
+                        implemented=implemented(v, referral_type),
+                    )
+                )
+                for href in self.objects(self.this, f"eli:{referral_type}")
+                if type(href) is not Literal
+                for text in self.objects(href, "lxp:id_human")
+                for title in self.objects(href, "eli:title") or [None]
+                for v in self.implementers(href) or [None]
+            ]
+            if anchors:
+                yield referral_type, anchors
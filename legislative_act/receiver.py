@@ -1,29 +1,138 @@
 from lxml import etree as et
-from rdflib import Graph, URIRef, Namespace, RDF, Literal, XSD
-import re
-from collections import defaultdict
 import logging
+import multiprocessing
 from copy import deepcopy
 
-from .utils.generics import ignore_void_dict
 from .utils.htm import undress, inner_tostring
 from . import model as dm
+from .rdfa import RDFaExtractor
 from .toccordior import ContentsTable
-from .history import DocumentVersion
-from settings import DEFAULT_IRI
+from .history import DocumentVersion, source_hash
+from .instrumentation import phase
+from settings import RECEIVER_PROCESSES, RECEIVER_PARALLEL_MIN_PARTS
 
 
 class DataIntegrityException(Exception):
     pass
 
 
-def adapt_ids(element: et.ElementBase, id_prefix):
-    for item in element.xpath(".//*[@id]"):
+def adapt_ids(element: et.ElementBase, id_prefix, descendants=None):
+    if descendants is None:
+        descendants = element.xpath(".//*[@id]")
+    for item in descendants:
         id_ = item.attrib["id"]
         if id_.startswith(id_prefix):
             item.attrib["id"] = id_.replace(id_prefix, "", 1)
 
 
+def html_parser():
+    return et.HTMLParser(remove_blank_text=True, remove_comments=True)
+
+
+def _build(job):
+    factory, source = job
+    # The HTML parser wraps the fragment into html and body elements.
+    body = et.fromstring(source, parser=html_parser()).find("body")
+    element = body[0]
+    body.remove(element)
+    return factory(element)
+
+
+def build_parts(jobs, pool=None) -> list:
+    """Calls each job's factory with the job's element and further arguments.
+    Given a process pool, the elements are serialized and the factories are
+    called by the pool's workers, with the element only. Either way, the
+    results are in the order of the jobs.
+    """
+    if pool is None:
+        return [factory(*args) for factory, *args in jobs]
+    serialized = [
+        (factory, et.tostring(element, with_tail=False))
+        for factory, element, *_ in jobs
+    ]
+    return pool.map(_build, serialized)
+
+
+class ReferringArticle:
+    """Article element whose in-document references are to be adapted"""
+
+    def __init__(self, id_):
+        self.id = id_
+        self.ids = [id_]
+        self._mesa_ids = None
+
+    @property
+    def mesa_ids(self) -> set:
+        if self._mesa_ids is None:
+            self._mesa_ids = {i for i in self.ids if not i.startswith(f"{self.id}-")}
+        return self._mesa_ids
+
+
+class SourceWalk:
+    """Single pass over the source document, collecting the elements that
+    are transformed or extracted by the DocumentReceiver in document order.
+    """
+
+    structure_classes = ("lxp-article", "lxp-final", "lxp-container")
+
+    def __init__(self, source: et.ElementBase):
+        self.definitions = []
+        self.preamble = None
+        self.recitals = []
+        # Articles, final provisions and containers:
+        self.structure = []
+        # Pairs of anchor and the referring articles containing it:
+        self.anchors = []
+        # Descendants carrying an id, per element whose ids are adapted:
+        self.id_bearers = {}
+        self._walk(source)
+
+    def _walk(self, source: et.ElementBase):
+        referring = []
+        id_collectors = []
+        recital_collectors = []
+        # Pairs of element and the stack to be popped at its end:
+        closing = []
+        for event, element in et.iterwalk(source, events=("start", "end")):
+            if event == "end":
+                while closing and closing[-1][0] is element:
+                    closing.pop()[1].pop()
+                continue
+            attrib = element.attrib
+            class_ = attrib.get("class")
+            id_ = attrib.get("id")
+            if id_ is not None:
+                for bearers in id_collectors:
+                    bearers.append(element)
+                for article in referring:
+                    article.ids.append(id_)
+            if element.tag == "a" and "href" in attrib:
+                self.anchors.append((element, tuple(referring)))
+            if class_ == "lxp-definition":
+                self.definitions.append(element)
+            elif class_ == "lxp-recital":
+                for recitals in recital_collectors:
+                    recitals.append(element)
+            elif class_ == "lxp-preamble" and self.preamble is None:
+                self.preamble = element
+                recital_collectors.append(self.recitals)
+                closing.append((element, recital_collectors))
+            if (
+                element.tag == "article"
+                and class_ is not None
+                and class_ != "lxp-mesa-article"
+                and id_ is not None
+            ):
+                referring.append(ReferringArticle(id_))
+                closing.append((element, referring))
+            if class_ in self.structure_classes:
+                self.structure.append(element)
+            if class_ in ("lxp-preamble", "lxp-article", "lxp-final"):
+                bearers = self.id_bearers.setdefault(element, [])
+                id_collectors.append(bearers)
+                closing.append((element, id_collectors))
+
+
 class Twix(dm.Twix):
     MAXLEN = 10**6
 
@@ -38,15 +147,19 @@ class Twix(dm.Twix):
 
 
 class Preamble(dm.Preamble):
-    def __init__(self, element: et.ElementBase):
+    def __init__(
+        self, element: et.ElementBase, descendants=None, recitals=None, pool=None
+    ):
         meta_id = "PRE"
-        recitals = et.Element("recitals")
-        adapt_ids(element, meta_id + "-")
-        for recital in element.xpath('.//*[@class="lxp-recital"]'):
+        adapt_ids(element, meta_id + "-", descendants)
+        if recitals is None:
+            recitals = element.xpath('.//*[@class="lxp-recital"]')
+        container = et.Element("recitals")
+        for recital in recitals:
             # remove them from the preamble
-            recitals.append(recital)
+            container.append(recital)
         super().__init__(
-            recitals=[Recital(e) for e in recitals.xpath('.//*[@class="lxp-recital"]')],
+            recitals=build_parts([(Recital, e) for e in recitals], pool),
             body=Twix(element),
             ordinate=element.attrib["title"],
             meta={"_id": meta_id},
@@ -98,8 +211,8 @@ class Definition(dm.Definition):
 
 
 class Article(dm.Article):
-    def __init__(self, element: et.ElementBase):
-        adapt_ids(element, element.attrib["id"] + "-")
+    def __init__(self, element: et.ElementBase, descendants=None):
+        adapt_ids(element, element.attrib["id"] + "-", descendants)
         super().__init__(
             heading=Heading(element.find('./*[@class="lxp-heading"]')),
             body=Twix(element.find('./*[@class="lxp-body"]')),
@@ -130,55 +243,83 @@ class DocumentReceiver(DocumentVersion):
     _cover_fields = dm.Cover.get_fields()
 
     @classmethod
-    def relaxed_instantiation(cls, sauce: str, logger=logging.getLogger(__name__)):
-        source = et.fromstring(
-            sauce, parser=et.HTMLParser(remove_blank_text=True, remove_comments=True)
-        )
+    def relaxed_instantiation(
+        cls, sauce: str, logger=logging.getLogger(__name__), processes=None
+    ):
+        with phase("parse"):
+            source = et.fromstring(sauce, parser=html_parser())
         try:
-            return cls(source, logger)
+            result = cls(source, logger, processes)
         except DataIntegrityException:
             logger.warning("Something went wrong", exc_info=True)
             body = source.find("body")
             source.remove(body)
-            return cls(source, logger)
-
-    def __init__(self, source: et.ElementBase, logger: logging.Logger):
+            result = cls(source, logger, processes)
+        result.source_hash = source_hash(sauce)
+        return result
+
+    def __init__(self, source: et.ElementBase, logger: logging.Logger, processes=None):
+        """<processes>: Number of processes to instantiate the document's parts.
+        Defaults to settings.RECEIVER_PROCESSES.
+        """
         self.logger = logger
         self.source = source
         assert self.source.attrib["lang"].lower() == dm.language
-        self.graph = LexGraph(self.source)
-        date_document = self.graph.date_document
-        cover = self._extract_cover()
+        with phase("metadata"):
+            self.metadata = RDFaExtractor(self.source)
+            date_document = self.metadata.date_document
+            cover = self._extract_cover()
         super().__init__(
             version=cover.abstract.version[0], cover=cover, date_document=date_document
         )
         self.available = False
         if self.source.find("body") is not None:
-            self._adapt_references()
-            self.definitions = [
-                # Definitions come first. Otherwise extraction per article
-                Definition(element)
-                for element in self.source.xpath('.//*[@class="lxp-definition"]')
-            ]
-            self.preamble = Preamble(self.source.find('.//*[@class="lxp-preamble"]'))
-            self.toc = dm.ContentsTable(table=[self.preamble.toc_node()])
-            self.articles = []
-            for element in self.source.xpath(
-                '//*[@class="lxp-article"] '
-                '| //*[@class="lxp-final"]'
-                '| //*[@class="lxp-container"]'
-            ):
-                # Note that the order of self.toc.table matters!
-                if element.attrib["class"] in ("lxp-article", "lxp-final"):
-                    article = Article(element)
-                    self.articles.append(article)
-                    self.toc.table.append(article.toc_node())
+            with phase("references"):
+                walk = SourceWalk(self.source)
+                self._adapt_references(walk)
+            if processes is None:
+                processes = RECEIVER_PROCESSES
+            parts = len(walk.definitions) + len(walk.recitals) + len(walk.structure)
+            with phase("parts"):
+                if processes > 1 and parts >= RECEIVER_PARALLEL_MIN_PARTS:
+                    with multiprocessing.Pool(processes) as pool:
+                        self._extract_parts(walk, pool)
                 else:
-                    self.toc.table.append(ContentsTableNode(element))
-            self._insert_base()
-            self.integrity_checks()  # Currently no check on metadata.
+                    self._extract_parts(walk)
+                self._insert_base()
+            with phase("integrity_checks"):
+                self.integrity_checks()  # Currently no check on metadata.
             self.available = True
         self._set_ids()
+        with phase("fingerprints"):
+            self._set_fingerprints()
+
+    def _extract_parts(self, walk: SourceWalk, pool=None):
+        articles = [
+            element
+            for element in walk.structure
+            if element.attrib["class"] in ("lxp-article", "lxp-final")
+        ]
+        # Definitions come first. Otherwise extraction per article
+        # would remove the article's prefix from the definitions' ids.
+        parts = build_parts(
+            [(Definition, element) for element in walk.definitions]
+            + [(Article, element, walk.id_bearers[element]) for element in articles],
+            pool,
+        )
+        self.definitions = parts[: len(walk.definitions)]
+        self.articles = parts[len(walk.definitions) :]
+        self.preamble = Preamble(
+            walk.preamble, walk.id_bearers.get(walk.preamble), walk.recitals, pool
+        )
+        self.toc = dm.ContentsTable(table=[self.preamble.toc_node()])
+        articles = iter(self.articles)
+        for element in walk.structure:
+            # Note that the order of self.toc.table matters!
+            if element.attrib["class"] in ("lxp-article", "lxp-final"):
+                self.toc.table.append(next(articles).toc_node())
+            else:
+                self.toc.table.append(ContentsTableNode(element))
 
     def integrity_checks(self):
         """Check if the submitted document would work as expected"""
@@ -188,22 +329,19 @@ class DocumentReceiver(DocumentVersion):
         except Exception as e:
             raise DataIntegrityException(str(e))
 
-    def _adapt_references(self):
+    def _adapt_references(self, walk: SourceWalk = None):
+        if walk is None:
+            walk = SourceWalk(self.source)
         prefix = f"/{self.cover.abstract.domain}" f"/{self.cover.abstract.id_local}/"
-        for article in self.source.xpath(
-            '//article[@class!="lxp-mesa-article" and @id]'
-        ):
-            id_ = article.attrib["id"]
-            mesa_ids = {
-                i for i in article.xpath(".//@id") if not i.startswith(f"{id_}-")
-            }
-            for anchor in article.xpath(".//a[@href]"):
+        for anchor, articles in walk.anchors:
+            for article in articles:
+                id_ = article.id
                 href = anchor.attrib["href"]
                 if href.startswith(f"#{id_}-"):
                     anchor.attrib["href"] = href.replace(f"#{id_}-", "#")
                 elif href.startswith("#toc-"):
                     anchor.attrib["href"] = prefix + "TOC" + href
-                elif href.startswith("#") and not (href[1:] in mesa_ids):
+                elif href.startswith("#") and not (href[1:] in article.mesa_ids):
                     if "-" in href:
                         tail = href[1:].replace("-", "/#", 1).strip("#")
                     else:
@@ -211,7 +349,7 @@ class DocumentReceiver(DocumentVersion):
                     anchor.attrib["href"] = prefix + tail
 
     def _extract_cover(self):
-        cover = self.graph.plain_predicates()
+        cover = self.metadata.plain_predicates()
         abstract = {
             key: cover.pop(key)[0]
             for key in set(self._abstract_fields) & set(cover.keys())
@@ -228,7 +366,7 @@ class DocumentReceiver(DocumentVersion):
         for miss in missed:
             self.logger.warning(f"Missing filter field: {miss}")
         cover["abstract"] = dm.Abstract(**abstract)
-        for referral_type, anchors in self.graph.iter_anchors():
+        for referral_type, anchors in self.metadata.iter_anchors():
             cover[referral_type] = anchors
         return dm.Cover(**cover)
 
@@ -249,140 +387,12 @@ class DocumentReceiver(DocumentVersion):
                 inter = part.meta.id
             part.meta.id = "-".join((id_prefix, inter, self.version))
 
+    def _set_fingerprints(self):
+        for part in self.iter_parts():
+            part.fingerprint = part.compute_fingerprint()
+
     def importance_rule(self):
         if getattr(self.cover, "short_title", False):
             return 1.0
         # CRR has ca. 500 Articles as coarse reference
         return round(0.8 * min(500, len(self.articles)) / 500.0, 6)
-
-
-class LexGraph(Graph):
-
-    custom_namespace = {
-        "eli": Namespace("http://data.europa.eu/eli/ontology#"),
-        "lxp": Namespace("http://lexparency.org/ontology#"),
-    }
-
-    referral_types = list(dm.Cover.iter_anchors())
-
-    relevant_prefixes = re.compile(
-        "^(?P<prefix>{})".format("|".join(custom_namespace.values()))
-        + "(?P<predicate>.+)"
-    )
-
-    def __init__(self, document: et.ElementBase):
-        super().__init__()
-        for pair in self.custom_namespace:
-            self.bind(*pair)
-        self._refs = set()
-        self._parse(document)
-
-    def add_ref(self, ref: str):
-        if ref.startswith("/"):
-            ref = DEFAULT_IRI + ref
-        ref = URIRef(ref)
-        if ref not in self._refs:
-            self._refs.add(ref)
-            self.add((ref, RDF.type, self.custom_namespace["eli"].Work))
-        return ref
-
-    def _parse(self, document: et.ElementBase):
-        this = self.add_ref(DEFAULT_IRI)
-        for meta in document.xpath(".//meta[@property] | .//span[@property]"):
-            attribs = meta.attrib
-            namespace, verb = attribs["property"].split(":")
-            predicate = self.custom_namespace[namespace][verb]
-            if attribs.get("datatype", "").startswith("xsd:"):
-                datatype = attribs["datatype"].split(":", 1)[1]
-                value = Literal(attribs["content"], datatype=XSD[datatype])
-            elif attribs.get("lang"):
-                value = Literal(attribs["content"], lang=attribs["lang"])
-            elif "resource" in attribs:
-                value = self.add_ref(attribs["resource"])
-            else:
-                value = Literal(attribs["content"])
-            if "about" in attribs:
-                subject = self.add_ref(attribs["about"])
-            else:
-                subject = this
-            self.add((subject, predicate, value))
-
-    @property
-    def query_prefix(self):
-        return "\n".join(
-            f"PREFIX {key}: <{value}>"
-            for key, value in self.custom_namespace.items()
-        )
-
-    def query(self, query, *args, **kwargs):
-        return super().query(self.query_prefix + "\n" + query, *args, **kwargs)
-
-    @property
-    def date_document(self):
-        result = self.query(
-            f"""
-                SELECT ?o
-                WHERE {{
-                    <{DEFAULT_IRI}> eli:date_document ?o .
-                    FILTER(isLiteral(?o))
-                }}
-            """
-        )
-        for (o,) in result:
-            return o.toPython()
-
-    def plain_predicates(self) -> dict:
-        result = self.query(
-            f"""
-                SELECT ?p ?o
-                WHERE {{
-                    <{DEFAULT_IRI}> ?p ?o .
-                    FILTER(isLiteral(?o))
-                }}
-            """
-        )
-        outcome = defaultdict(list)
-        for p, o in result:
-            m = self.relevant_prefixes.match(p)
-            if m is None:
-                continue
-            outcome[m.group("predicate")].append(o.toPython())
-        return outcome
-
-    def iter_anchors(self):
-        def implemented(v, r_type):
-            if v is None:
-                if r_type in dm.Anchor.changers:
-                    return False  # is the default for referrers
-                return
-            return v.toPython() == DEFAULT_IRI
-
-        for referral_type in self.referral_types:
-            query_result = self.query(
-                f"""
-                    SELECT ?href ?title ?text ?v
-                    WHERE {{
-                        <{DEFAULT_IRI}> eli:{referral_type} ?href .
-                        ?href lxp:id_human ?text .
-                        OPTIONAL {{
-                            ?href eli:title ?title .
-                        }}
-                        OPTIONAL {{
-                            ?v lxp:version_implements ?href .
-                        }}
-                    }}
-                """
-            )
-            if not query_result:
-                continue
-            yield referral_type, [
-                dm.Anchor(
-                    **ignore_void_dict(
-                        href=href.toPython(),
-                        text=text.toPython() if text is not None else None,
-                        title=title.toPython() if title is not None else None,
-                        implemented=implemented(v, referral_type),
-                    )
-                )
-                for href, title, text, v in query_result
-            ]
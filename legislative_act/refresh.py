@@ -0,0 +1,96 @@
+"""
+When writes to the index become visible to searches (cf. REFRESH_POLICY):
+ - "none": Whenever elasticsearch refreshes the index on its own.
+ - "wait_for": The writes whose results are searched for right away (the
+   parts of a document, relations, national references, in_force flags)
+   wait until they are visible. No refresh is forced, except after writes
+   that cannot wait themselves, e.g. updates and deletes by query (cf. settle).
+ - "explicit": The index is refreshed once after each write operation.
+Documents retrieved by ID, e.g. the version maps, are visible right away
+regardless.
+For mass loads, cf. bulk_load.
+"""
+from contextlib import contextmanager
+from functools import wraps
+
+from . import model as dm
+from settings import REFRESH_POLICY
+
+POLICIES = ("none", "wait_for", "explicit")
+FORCEMERGE_TIMEOUT = 60 * 60  # seconds
+
+_policy = REFRESH_POLICY
+
+
+def get_policy() -> str:
+    return _policy
+
+
+def set_policy(policy: str) -> str:
+    """Sets the policy for this process and returns the previous one."""
+    global _policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown refresh policy: {policy}")
+    previous, _policy = _policy, policy
+    return previous
+
+
+def write_kwargs() -> dict:
+    """Keyword arguments for write requests, e.g. doc.save(**write_kwargs())"""
+    if _policy == "wait_for":
+        return {"refresh": "wait_for"}
+    return {}
+
+
+def settle():
+    """To be called after writes that cannot wait for the refresh
+    themselves, e.g. deletes by query or series of single writes.
+    """
+    if _policy == "wait_for":
+        dm.index.refresh()
+
+
+def refreshed(f):
+    """Decorator for write operations. Refreshes the index
+    after execution if the policy is "explicit".
+    """
+
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        result = f(*args, **kwargs)
+        if _policy == "explicit":
+            dm.index.refresh()
+        return result
+
+    return wrapped
+
+
+@contextmanager
+def bulk_load(index=None):
+    """Switches the index into bulk-load mode: No refreshes, no replicas, and
+    the refresh policy "none" for this process. Afterwards, even if the job fails, the index's
+    settings are restored, and it is force-merged and refreshed.
+    Usage:
+        with bulk_load():
+            DocumentVersion.save_all(docs)
+    """
+    index = index or dm.index
+    ((_, current),) = index.get_settings().items()
+    current = current["settings"]["index"]
+    # refresh_interval is only present if it deviates from the default.
+    # Restoring it as None resets it to the default.
+    original = {
+        "refresh_interval": current.get("refresh_interval"),
+        "number_of_replicas": current["number_of_replicas"],
+    }
+    index.put_settings(
+        body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+    )
+    previous = set_policy("none")
+    try:
+        yield index
+    finally:
+        set_policy(previous)
+        index.put_settings(body={"index": original})
+        index.forcemerge(request_timeout=FORCEMERGE_TIMEOUT)
+        index.refresh()
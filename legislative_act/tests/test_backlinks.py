@@ -0,0 +1,65 @@
+from unittest import main, TestCase
+from unittest.mock import patch
+
+from elasticsearch_dsl import AttrDict
+
+from legislative_act import model as dm
+from legislative_act.backlinks import pending_backlinks, propagate
+from settings import DEFAULT_IRI
+
+
+def cover(id_local, **anchors):
+    result = dm.Cover(
+        abstract=dm.Abstract(domain="eu", id_local=id_local, version=["initial"]),
+        **{
+            name: [dm.Anchor(href=f"{DEFAULT_IRI}/eu/{i}/", text=i) for i in ids]
+            for name, ids in anchors.items()
+        },
+    )
+    result.meta.id = f"eu-{id_local}-COV-initial"
+    return result
+
+
+def hit(id_local, **anchors):
+    return AttrDict(
+        {
+            "meta": {"id": f"eu-{id_local}-COV-initial"},
+            "abstract": {"domain": "eu", "id_local": id_local},
+            **{
+                name: [{"href": f"{DEFAULT_IRI}/eu/{i}/", "text": i} for i in ids]
+                for name, ids in anchors.items()
+            },
+        }
+    )
+
+
+class TestBacklinks(TestCase):
+    def test_pending(self):
+        amending = cover("32019R0876", amends=["32013R0575"], cites=["32016R0679"])
+        pending = pending_backlinks([amending])
+        self.assertEqual(
+            {("eu", "32013R0575"), ("eu", "32016R0679")}, set(pending.keys())
+        )
+        self.assertEqual(
+            [f"{DEFAULT_IRI}/eu/32019R0876/"],
+            [a["href"] for a in pending[("eu", "32013R0575")]["amended_by"]],
+        )
+
+    @patch("legislative_act.backlinks.BulkActions.commit")
+    @patch("legislative_act.model.Search")
+    def test_propagate(self, search, commit):
+        search.return_value.filter.return_value = search.return_value
+        search.return_value.scan.return_value = [
+            hit("32013R0575", amended_by=["32019R0876"]),
+            hit("32016R0679"),
+        ]
+        amending = cover("32019R0876", amends=["32013R0575"], cites=["32016R0679"])
+        self.assertEqual(1, propagate([amending]))
+        search.return_value.filter.assert_any_call(
+            "terms", abstract__id_local=["32013R0575", "32016R0679"]
+        )
+        commit.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    main()
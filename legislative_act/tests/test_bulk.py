@@ -0,0 +1,116 @@
+from unittest import main, TestCase
+from unittest.mock import patch, Mock
+
+from legislative_act import model as dm
+from legislative_act.bulk import BulkActions, BulkWriteError
+
+
+def article(id_, version="initial"):
+    result = dm.Article(
+        abstract=dm.Abstract(
+            domain="eu", id_local="dummy", version=[version], is_latest=True
+        ),
+        heading=dm.Heading(ordinate="Article 1"),
+        body=dm.Twix(stripped="Text", dressed="<p>Text</p>"),
+    )
+    result.meta.id = id_
+    return result
+
+
+class TestBulkActions(TestCase):
+    def setUp(self):
+        self.bulk = BulkActions()
+
+    def test_actions(self):
+        self.bulk.index(article("eu-dummy-ART_1-initial"))
+        self.bulk.update("eu-dummy-ART_2-initial", in_force=False)
+        self.bulk.update("eu-dummy-ART_2-initial", is_latest=False)
+        self.bulk.delete("eu-dummy-ART_3-initial")
+        actions = list(self.bulk.iter_actions())
+        self.assertEqual(
+            ["index", "update", "delete"], [a["_op_type"] for a in actions]
+        )
+        self.assertEqual(
+            {"abstract": {"in_force": False, "is_latest": False}, "versions": []},
+            actions[1]["script"]["params"],
+        )
+        self.assertEqual("article", actions[0]["_source"]["doc_type"])
+
+    def test_update_pending_index(self):
+        a = article("eu-dummy-ART_1-initial")
+        self.bulk.index(a)
+        self.bulk.update(a.meta.id, is_latest=False)
+        self.assertEqual(1, len(self.bulk))
+        (action,) = self.bulk.iter_actions()
+        self.assertFalse(action["_source"]["abstract"]["is_latest"])
+
+    def test_append_version(self):
+        a = article("eu-dummy-ART_1-initial")
+        self.bulk.index(a)
+        self.bulk.append_version(a.meta.id, "20200101")
+        self.bulk.append_version("eu-dummy-ART_2-initial", "20200101")
+        self.bulk.append_version("eu-dummy-ART_2-initial", "20200101")
+        indexed, updated = self.bulk.iter_actions()
+        self.assertEqual(
+            ["initial", "20200101"], indexed["_source"]["abstract"]["version"]
+        )
+        self.assertEqual(["20200101"], updated["script"]["params"]["versions"])
+
+    def test_shared_abstract(self):
+        a, b = article("eu-dummy-ART_1-initial"), article("eu-dummy-ART_2-initial")
+        b.abstract = a.abstract
+        self.bulk.index(a)
+        self.bulk.index(b)
+        self.bulk.update(a.meta.id, is_latest=False)
+        self.bulk.append_version(a.meta.id, "20200101")
+        first, second = self.bulk.iter_actions()
+        self.assertFalse(first["_source"]["abstract"]["is_latest"])
+        self.assertEqual(
+            ["initial", "20200101"], first["_source"]["abstract"]["version"]
+        )
+        self.assertTrue(second["_source"]["abstract"]["is_latest"])
+        self.assertEqual(["initial"], second["_source"]["abstract"]["version"])
+
+    def test_append_anchor(self):
+        anchor = {"href": "https://lexparency.org/eu/32019R0876/", "text": "CRR II"}
+        self.bulk.append_anchor("eu-32013R0575-COV-initial", "amended_by", anchor)
+        self.bulk.append_anchor("eu-32013R0575-COV-initial", "amended_by", anchor)
+        (action,) = self.bulk.iter_actions()
+        self.assertEqual(
+            {"amended_by": [anchor]}, action["script"]["params"]["anchors"]
+        )
+
+    def test_remove_version(self):
+        self.bulk.index(article("eu-dummy-ART_1-initial"))
+        self.bulk.append_version("eu-dummy-ART_1-initial", "20190930")
+        self.bulk.remove_version("eu-dummy-ART_1-initial", "20190930")
+        self.bulk.remove_version("eu-dummy-ART_2-initial", "20190930")
+        first, second = self.bulk.iter_actions()
+        self.assertEqual(["initial"], first["_source"]["abstract"]["version"])
+        self.assertEqual(["20190930"], second["script"]["params"]["removed_versions"])
+
+    @patch("legislative_act.bulk.connections", Mock())
+    @patch("legislative_act.bulk.streaming_bulk")
+    def test_delete_missing(self, streaming_bulk):
+        streaming_bulk.return_value = [
+            (False, {"delete": {"_id": "a", "status": 404, "result": "not_found"}}),
+        ]
+        self.bulk.delete("a")
+        self.assertEqual(404, self.bulk.commit()[0]["status"])
+
+    @patch("legislative_act.bulk.connections", Mock())
+    @patch("legislative_act.bulk.streaming_bulk")
+    def test_commit_errors(self, streaming_bulk):
+        streaming_bulk.return_value = [
+            (True, {"index": {"_id": "a", "status": 201, "result": "created"}}),
+            (False, {"update": {"_id": "b", "status": 404, "error": "missing"}}),
+        ]
+        self.bulk.update("b", is_latest=False)
+        with self.assertRaises(BulkWriteError) as cm:
+            self.bulk.commit()
+        self.assertEqual(["b"], [e["_id"] for e in cm.exception.errors])
+        self.assertEqual(0, len(self.bulk))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+from unittest import main, TestCase
+from unittest.mock import Mock, patch
+from datetime import date
+import json
+import os
+import tempfile
+
+from elasticsearch.exceptions import ConnectionTimeout
+
+from legislative_act import ingest
+from legislative_act.history import DocumentHistory, InconsistentVersionHistory
+from legislative_act.model import ExposedAndHiddenVersions, VersionAvailability
+from legislative_act.ingest import IngestQueue, IngestError
+
+
+class TestIngestQueue(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue = IngestQueue(os.path.join(self.directory.name, "queue.sqlite3"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_order(self):
+        first = self.queue.enqueue("eu", "<html>1</html>")
+        second = self.queue.enqueue("eu", "<html>2</html>")
+        self.assertEqual((first, "eu", "upload", "<html>1</html>"), self.queue.claim())
+        self.assertEqual((second, "eu", "upload", "<html>2</html>"), self.queue.claim())
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual("running", self.queue.status(first)["status"])
+
+    def test_status(self):
+        job_id = self.queue.enqueue("eu", "<html/>")
+        self.assertEqual("queued", self.queue.status(job_id)["status"])
+        self.queue.claim()
+        self.queue.finish(job_id, "Uploaded to /eu/dummy/initial")
+        status = self.queue.status(job_id)
+        self.assertEqual("done", status["status"])
+        self.assertEqual("Uploaded to /eu/dummy/initial", status["message"])
+        self.assertEqual(1, status["attempts"])
+        self.assertIsNotNone(status["finished"])
+        self.assertIsNone(self.queue.status(job_id + 1))
+
+    def test_retry(self):
+        job_id = self.queue.enqueue("eu", "<html/>")
+        for _ in range(ingest.INGEST_MAX_ATTEMPTS - 1):
+            self.queue.claim()
+            self.queue.retry(job_id, "Timeout", delay=0)
+            self.assertEqual("queued", self.queue.status(job_id)["status"])
+        self.queue.claim()
+        self.queue.retry(job_id, "Timeout", delay=0)
+        self.assertEqual("failed", self.queue.status(job_id)["status"])
+
+    def test_retry_delay(self):
+        job_id = self.queue.enqueue("eu", "<html/>")
+        self.queue.claim()
+        self.queue.retry(job_id, "Timeout", delay=60)
+        self.assertIsNone(self.queue.claim())
+
+    def test_requeue_running(self):
+        job_id = self.queue.enqueue("eu", "<html/>")
+        self.queue.claim()
+        self.assertEqual(1, self.queue.requeue_running())
+        self.assertEqual(job_id, self.queue.claim()[0])
+
+    def test_document_lock(self):
+        self.assertTrue(self.queue.lock("eu-dummy"))
+        self.assertFalse(self.queue.lock("eu-dummy"))
+        self.assertTrue(self.queue.lock("eu-other"))
+        self.queue.unlock("eu-dummy")
+        with self.queue.locked("eu-dummy", poll_interval=0):
+            self.assertFalse(self.queue.lock("eu-dummy"))
+        self.assertTrue(self.queue.lock("eu-dummy"))
+        self.queue.requeue_running()
+        self.assertTrue(self.queue.lock("eu-other"))
+
+    @patch("legislative_act.ingest.backfill")
+    def test_process_backfill(self, backfill):
+        backfill.return_value = "Uploaded 2 versions to /eu/dummy/"
+        job_id = self.queue.enqueue(
+            "eu", '["<html>1</html>", "<html>2</html>"]', "backfill"
+        )
+        ingest.process(self.queue, self.queue.claim())
+        backfill.assert_called_once_with(
+            "eu", ["<html>1</html>", "<html>2</html>"], self.queue, self.queue
+        )
+        self.assertEqual("done", self.queue.status(job_id)["status"])
+
+    @patch("legislative_act.ingest.propagate")
+    @patch("legislative_act.ingest.dm.get_many")
+    def test_process_backlinks(self, get_many, propagate):
+        get_many.return_value = {"eu-dummy-COV-initial": "cover"}
+        propagate.return_value = 2
+        job_id = self.queue.enqueue("eu", '["eu-dummy-COV-initial"]', "backlinks")
+        ingest.process(self.queue, self.queue.claim())
+        propagate.assert_called_once()
+        self.assertEqual(["cover"], list(propagate.call_args[0][0]))
+        self.assertEqual(
+            "Propagated relations to 2 document(s)",
+            self.queue.status(job_id)["message"],
+        )
+
+    def test_defer_backlinks(self):
+        history = DocumentHistory(
+            availabilities=[
+                VersionAvailability(version=v, date_document=date(2020, 1, d))
+                for d, v in enumerate(("initial", "later"), start=1)
+            ],
+            exposed_and_hidden=[
+                ExposedAndHiddenVersions(
+                    sub_id="COV",
+                    hidden_version="initial",
+                    exposed_versions=["initial", "later"],
+                )
+            ],
+        )
+        history.meta.id = "eu-dummy"
+        later = Mock(version="later")
+        later.find_history.return_value = history
+        ingest.defer_backlinks(self.queue, "eu", [later])
+        _, _, _, payload = self.queue.claim()
+        self.assertEqual(["eu-dummy-COV-initial"], json.loads(payload))
+
+    @patch("legislative_act.ingest.INGEST_DEFER_BACKLINKS", False)
+    @patch("legislative_act.ingest.DocumentHistory.find_upload", return_value=None)
+    @patch("legislative_act.ingest.DocumentReceiver")
+    def test_lock_without_deferral(self, receiver, _):
+        dr = receiver.relaxed_instantiation.return_value
+        dr.domain, dr.id_local, dr.version = "eu", "dummy", "initial"
+        dr.save.side_effect = lambda **_: self.assertFalse(self.queue.lock("eu-dummy"))
+        job_id = self.queue.enqueue("eu", "<html/>")
+        ingest.process(self.queue, self.queue.claim())
+        self.assertEqual("done", self.queue.status(job_id)["status"])
+        dr.save.assert_called_once_with(backlinks=True)
+        self.assertIsNone(self.queue.claim())  # no backlinks job
+        self.assertTrue(self.queue.lock("eu-dummy"))
+
+    @patch("legislative_act.ingest.DocumentReceiver")
+    @patch("legislative_act.ingest.DocumentHistory.find_upload")
+    def test_repeated_upload(self, find_upload, receiver):
+        find_upload.return_value = "/eu/dummy/initial"
+        self.assertEqual(
+            "Already present at /eu/dummy/initial",
+            ingest.incorporate("eu", "<html/>"),
+        )
+        find_upload.assert_called_once_with(ingest.source_hash("<html/>"))
+        receiver.relaxed_instantiation.assert_not_called()
+
+    @patch("legislative_act.ingest.DocumentHistory")
+    @patch("legislative_act.ingest.DocumentReceiver")
+    def test_existing_version(self, receiver, history):
+        history.find_upload.return_value = None
+        dr = receiver.relaxed_instantiation.return_value
+        dr.domain = "eu"
+        dr.save.side_effect = InconsistentVersionHistory("Version initial exists")
+        with self.assertRaises(IngestError):
+            ingest.incorporate("eu", "<html/>")
+        history.get.assert_not_called()
+
+    @patch("legislative_act.ingest.incorporate")
+    def test_process_metrics(self, incorporate):
+        def fake_incorporate(*_):
+            ingest.label(document="/eu/dummy/initial")
+            with ingest.phase("bulk"):
+                pass
+            return "Uploaded to /eu/dummy/initial"
+
+        incorporate.side_effect = fake_incorporate
+        job_id = self.queue.enqueue("eu", "<html/>")
+        with self.assertLogs("legislative_act.ingest.metrics") as logs:
+            ingest.process(self.queue, self.queue.claim())
+        metrics = self.queue.status(job_id)["metrics"]
+        self.assertEqual("/eu/dummy/initial", metrics["document"])
+        self.assertEqual(
+            {"seconds", "es_calls", "es_bytes"}, set(metrics["phases"]["bulk"])
+        )
+        (line,) = logs.records
+        self.assertEqual(
+            {"job": job_id, "kind": "upload", "status": "done", **metrics},
+            json.loads(line.getMessage()),
+        )
+
+    @patch("legislative_act.ingest.incorporate")
+    def test_process(self, incorporate):
+        outcomes = {
+            "<html>ok</html>": "Uploaded to /eu/dummy/initial",
+            "<html>domain</html>": IngestError("Inconsistent document domain"),
+            "<html>timeout</html>": ConnectionTimeout("TIMEOUT", "", None),
+            "<html>broken</html>": KeyError("lang"),
+        }
+
+        def fake_incorporate(_, source, *__):
+            outcome = outcomes[source]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        incorporate.side_effect = fake_incorporate
+        job_ids = {source: self.queue.enqueue("eu", source) for source in outcomes}
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                break
+            ingest.process(self.queue, job)
+        status = {s: self.queue.status(i)["status"] for s, i in job_ids.items()}
+        self.assertEqual(
+            {
+                "<html>ok</html>": "done",
+                "<html>domain</html>": "failed",
+                "<html>timeout</html>": "queued",
+                "<html>broken</html>": "failed",
+            },
+            status,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from unittest import main, TestCase
+
+from legislative_act import instrumentation
+from legislative_act.instrumentation import label, phase, recording
+
+
+class TestRecording(TestCase):
+    def test_nested_phases(self):
+        with recording() as record:
+            label(document="/eu/dummy/initial")
+            with phase("outer"):
+                instrumentation.count_request(b"{}")
+                with phase("inner"):
+                    instrumentation.count_request(b'{"a": 1}')
+                    instrumentation.count_request(None)
+            with phase("outer"):
+                pass
+        result = record.to_dict()
+        self.assertEqual("/eu/dummy/initial", result["document"])
+        outer, inner = result["phases"]["outer"], result["phases"]["inner"]
+        self.assertEqual((1, 2), (outer["es_calls"], outer["es_bytes"]))
+        self.assertEqual((2, 8), (inner["es_calls"], inner["es_bytes"]))
+        self.assertLessEqual(outer["seconds"] + inner["seconds"], result["seconds"])
+        self.assertGreaterEqual(outer["seconds"], 0)
+
+    def test_not_recording(self):
+        with phase("outer"):
+            instrumentation.count_request(b"{}")
+        self.assertIsNone(instrumentation.current())
+        with recording() as record:
+            instrumentation.count_request(b"{}")
+        self.assertEqual(1, record.to_dict()["phases"]["other"]["es_calls"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from unittest import main, TestCase
+import os
+from lxml import etree as et
+
+from legislative_act.rdfa import RDFaExtractor
+from legislative_act.lexgraph import LexGraph
+
+
+def anchor_set(anchors) -> set:
+    return {tuple(sorted(anchor.to_dict().items())) for anchor in anchors}
+
+
+class TestParity(TestCase):
+    """The single-pass extractor has to yield the same metadata as the
+    SPARQL-based reference implementation.
+    """
+
+    DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
+
+    @classmethod
+    def iter_sources(cls):
+        for root, _, files in os.walk(cls.DATA_PATH):
+            for name in sorted(files):
+                if not name.endswith(".html"):
+                    continue
+                path = os.path.join(root, name)
+                source = et.parse(path, parser=et.HTMLParser()).getroot()
+                yield os.path.relpath(path, cls.DATA_PATH), source
+
+    def test_parity(self):
+        count = 0
+        for name, source in self.iter_sources():
+            with self.subTest(document=name):
+                expected = LexGraph(source)
+                actual = RDFaExtractor(source)
+                self.assertEqual(expected.date_document, actual.date_document)
+                self.assertEqual(
+                    {
+                        key: sorted(map(repr, values))
+                        for key, values in expected.plain_predicates().items()
+                    },
+                    {
+                        key: sorted(map(repr, values))
+                        for key, values in actual.plain_predicates().items()
+                    },
+                )
+                self.assertEqual(
+                    {key: anchor_set(a) for key, a in expected.iter_anchors()},
+                    {key: anchor_set(a) for key, a in actual.iter_anchors()},
+                )
+                count += 1
+        self.assertGreater(count, 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 from unittest import main, TestCase
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
 import os
 import json
 from lxml import etree as et
 
-from legislative_act.receiver import DocumentReceiver
+from legislative_act.receiver import DocumentReceiver, dm
 from legislative_act.utils.generics import convert_datetime_patterns, json_serial
 
 
@@ -85,6 +85,83 @@ class TestReceiver(TestCase):
         self.assertEqual(*ignore_order(flat_cover, cover.flat_dict()))
 
 
+class TestFingerprints(TestCase):
+
+    DATA_PATH = TestReceiver.DATA_PATH
+
+    def receive(self, name):
+        with open(os.path.join(self.DATA_PATH, name), mode="r") as f:
+            return DocumentReceiver.relaxed_instantiation(f.read(), logger=Mock())
+
+    @staticmethod
+    def reload(part):
+        """Imitates storing in and loading from the index"""
+        return dm.part_class(part.sub_id).from_es(
+            {
+                "_id": part.meta.id,
+                "_source": json.loads(json.dumps(part.to_dict(), default=json_serial)),
+            }
+        )
+
+    def test_change_detection(self):
+        initial = {
+            p.sub_id: self.reload(p)
+            for p in self.receive("document_1.html").iter_parts()
+        }
+        for part in self.receive("document_1a.html").iter_parts():
+            if part.sub_id not in initial:
+                continue
+            previous = initial[part.sub_id]
+            self.assertEqual(
+                part == previous,
+                part.fingerprint == previous.fingerprint,
+                f"Fingerprint does not reflect equality of {part.sub_id}",
+            )
+
+    def test_stable(self):
+        for part in self.receive("document_1.html").iter_parts():
+            self.assertEqual(part.fingerprint, self.reload(part).compute_fingerprint())
+
+
+class TestParallel(TestCase):
+
+    DATA_PATH = TestReceiver.DATA_PATH
+
+    @patch("legislative_act.receiver.RECEIVER_PARALLEL_MIN_PARTS", 0)
+    def test_parallel(self):
+        for name in ("document_1.html", "32016R0679-initial.html"):
+            with open(os.path.join(self.DATA_PATH, name), mode="r") as f:
+                sauce = f.read()
+            sequential = DocumentReceiver.relaxed_instantiation(
+                sauce, logger=Mock(), processes=1
+            )
+            parallel = DocumentReceiver.relaxed_instantiation(
+                sauce, logger=Mock(), processes=3
+            )
+            self.assertEqual(
+                [(p.meta.id, p.to_dict()) for p in sequential.iter_parts()],
+                [(p.meta.id, p.to_dict()) for p in parallel.iter_parts()],
+                name,
+            )
+
+    @patch("legislative_act.receiver.RECEIVER_PARALLEL_MIN_PARTS", 0)
+    @patch("legislative_act.receiver.RECEIVER_PROCESSES", 3)
+    def test_tail(self):
+        with open(os.path.join(self.DATA_PATH, "document_1.html"), mode="r") as f:
+            sauce = f.read()
+        for tag, start in (("</li>", "lxp-recital"), ("</article>", 'id="ART_1"')):
+            position = sauce.index(tag, sauce.index(start)) + len(tag)
+            sauce = sauce[:position] + "Trailing text" + sauce[position:]
+        sequential = DocumentReceiver.relaxed_instantiation(
+            sauce, logger=Mock(), processes=1
+        )
+        parallel = DocumentReceiver.relaxed_instantiation(sauce, logger=Mock())
+        self.assertEqual(
+            [(p.meta.id, p.to_dict()) for p in sequential.iter_parts()],
+            [(p.meta.id, p.to_dict()) for p in parallel.iter_parts()],
+        )
+
+
 class MinorTests(TestCase):
     dr_init = DocumentReceiver.__init__
 
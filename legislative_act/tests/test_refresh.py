@@ -0,0 +1,74 @@
+from unittest import main, TestCase
+from unittest.mock import patch, Mock, call
+
+from legislative_act import refresh
+
+
+class TestRefreshPolicy(TestCase):
+    def setUp(self):
+        self.previous = refresh.get_policy()
+
+    def tearDown(self):
+        refresh.set_policy(self.previous)
+
+    @patch("legislative_act.refresh.dm.index")
+    def test_policies(self, index):
+        @refresh.refreshed
+        def write():
+            refresh.settle()
+            return refresh.write_kwargs()
+
+        expected = {
+            "none": ({}, 0),
+            "wait_for": ({"refresh": "wait_for"}, 1),
+            "explicit": ({}, 1),
+        }
+        for policy, (kwargs, refreshs) in expected.items():
+            index.refresh.reset_mock()
+            refresh.set_policy(policy)
+            self.assertEqual(kwargs, write(), policy)
+            self.assertEqual(refreshs, index.refresh.call_count, policy)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            refresh.set_policy("always")
+        self.assertEqual(self.previous, refresh.get_policy())
+
+
+class TestBulkLoad(TestCase):
+    def setUp(self):
+        self.index = Mock()
+        self.index.get_settings.return_value = {
+            "legex-en": {
+                "settings": {
+                    "index": {"number_of_replicas": "1", "number_of_shards": "5"}
+                }
+            }
+        }
+
+    def test_restore_on_failure(self):
+        policy = refresh.get_policy()
+        with self.assertRaises(RuntimeError):
+            with refresh.bulk_load(self.index):
+                self.assertEqual("none", refresh.get_policy())
+                raise RuntimeError("Job failed")
+        self.assertEqual(policy, refresh.get_policy())
+        self.assertEqual(
+            [
+                call(
+                    body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+                ),
+                call(
+                    body={
+                        "index": {"refresh_interval": None, "number_of_replicas": "1"}
+                    }
+                ),
+            ],
+            self.index.put_settings.call_args_list,
+        )
+        self.index.forcemerge.assert_called_once()
+        self.index.refresh.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    main()
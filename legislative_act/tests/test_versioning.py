@@ -1,15 +1,80 @@
 from unittest import main, TestCase
 import os
 import json
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import NotFoundError, ConflictError
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
 from datetime import date
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+from copy import deepcopy
 
 from legislative_act.receiver import DocumentReceiver, dm
-from legislative_act.history import DocumentHistory
+from legislative_act import refresh
+from legislative_act.bulk import BulkActions, BulkWriteError
+from legislative_act.history import (
+    DocumentHistory,
+    DocumentVersion,
+    InconsistentVersionHistory,
+    source_hash,
+)
 from legislative_act.tests.test_receiver import ignore_order
 from legislative_act.utils import generics
 from legislative_act.utils.generics import convert_datetime_patterns, get_today
+from settings import VERSIONS_MAP_ATTEMPTS
+
+
+class BregVersions:
+    """Versions of the document in data/breg. The test cases combining it
+    with a plain TestCase keep the version maps in memory, with the writes
+    mocked where needed.
+    """
+
+    BREG_PATH = os.path.join(os.path.dirname(__file__), "data", "breg")
+    versions = ("initial.html", "20190930.html", "20191001.html")
+
+    def receive_all(self):
+        result = []
+        for name in self.versions:
+            with open(os.path.join(self.BREG_PATH, name), mode="r") as f:
+                result.append(
+                    DocumentReceiver.relaxed_instantiation(f.read(), logger=Mock())
+                )
+        return result
+
+    def serve_parts(self, *sources):
+        """dm.get_many serves the parts of the given documents, or the ones
+        indexed by the given BulkActions, instead of the index. E.g. to store
+        them under another ID (cf. DocumentHistory._rehide).
+        """
+        parts = {}
+        for source in sources:
+            if isinstance(source, BulkActions):
+                for action in source.iter_actions():
+                    if action["_op_type"] == "index":
+                        cls = dm.doc_type_classes.get(action["_source"]["doc_type"])
+                        parts[action["_id"]] = cls.from_es(deepcopy(action))
+            else:
+                parts.update((part.meta.id, part) for part in source.iter_parts())
+        patcher = patch.object(
+            dm,
+            "get_many",
+            side_effect=lambda ids, **_: {id_: deepcopy(parts[id_]) for id_ in ids},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertLogged(self, history):
+        """Logged changes agree with the derived ones."""
+        availables = [a.version for a in history.availabilities if a.available]
+        self.assertEqual(availables, [c.version for c in history.change_log])
+        for version in availables:
+            self.assertEqual(
+                list(history._derive_sub_id_change(version)),
+                list(history.sub_id_change(version)),
+            )
+            self.assertEqual(
+                history._derive_toc_changed(version), history.toc_changed(version)
+            )
 
 
 class TestBase(TestCase):
@@ -66,6 +131,9 @@ class TestHistory(TestBase):
             self.versions_1_1a.to_dict()["availabilities"],
             dh.to_dict()["availabilities"],
         )
+        self.assertEqual(
+            self.versions_1_1a.to_dict()["change_log"], dh.to_dict()["change_log"]
+        )
         for sub_id, is_latest in (("TOC", False), ("ART_1", False), ("ART_3", False)):
             part = dm.Base.get(
                 index=dm.index_name,
@@ -78,6 +146,19 @@ class TestHistory(TestBase):
                 f"Discrepancy for 'is_latest' at {sub_id}",
             )
 
+    def test_get_version(self):
+        dv = DocumentVersion.get(
+            self.document_1.domain, self.document_1.id_local, "initial"
+        )
+        self.assertEqual(
+            {p.meta.id: type(p).__name__ for p in self.document_1.iter_parts()},
+            {p.meta.id: type(p).__name__ for p in dv.iter_parts()},
+        )
+        self.assertEqual(
+            {p.meta.id: p.fingerprint for p in self.document_1.iter_parts()},
+            {p.meta.id: p.fingerprint for p in dv.iter_parts()},
+        )
+
     def test_insert_unavailable(self):
         self.document_1a.save()
         dh = DocumentHistory.get(
@@ -159,6 +240,591 @@ class TestHistory(TestBase):
         self.assertFalse(dh.in_force)
 
 
+class TestBackfill(BregVersions, TestBase):
+    def snapshot(self, doc):
+        dm.index.refresh()
+        dh = DocumentHistory.get(f"{doc.domain}-{doc.id_local}")
+        return dh.to_dict(), {hit.meta.id: hit.to_dict() for hit in dh.iter_atoms()}
+
+    def test_identical_to_sequential(self):
+        for doc in self.receive_all():
+            doc.save()
+        sequential = self.snapshot(doc)
+        DocumentHistory.get(f"{doc.domain}-{doc.id_local}").purge()
+        docs = self.receive_all()
+        DocumentVersion.save_all(list(reversed(docs)))
+        self.assertEqual(sequential, self.snapshot(docs[0]))
+
+
+class TestChanges(BregVersions, TestCase):
+    """Dry run against a version map in memory."""
+
+    def test_consistent_with_incorporate(self):
+        docs = self.receive_all()
+        history = docs[0].default_version_map()
+        self.assertEqual([], history.changes(docs[0])["unchanged"])
+        history._incorporate(docs[0], BulkActions())
+        for doc in docs[1:]:
+            before = history.to_dict()
+            changes = history.changes(doc)
+            self.assertEqual(before, history.to_dict())
+            bulk = BulkActions()
+            history._incorporate(doc, bulk)
+            ops = {a["_id"]: a["_op_type"] for a in bulk.iter_actions()}
+            indexed = {i.split("-")[2] for i, op in ops.items() if op == "index"}
+            self.assertEqual(set(changes["insert"] + changes["update"]), indexed)
+            self.assertEqual(
+                {p.sub_id for p in doc.iter_parts()},
+                set(changes["insert"] + changes["update"] + changes["unchanged"]),
+            )
+            self.assertEqual("TOC" in indexed, changes["toc_changed"])
+            for sub_id in changes["obsolete"]:
+                self.assertNotIn(sub_id, indexed)
+
+    def test_source_hash(self):
+        doc = self.receive_all()[0]
+        history = doc.default_version_map()
+        history._incorporate(doc, BulkActions())
+        with open(os.path.join(self.BREG_PATH, self.versions[0])) as f:
+            self.assertEqual(
+                source_hash(f.read()), history.availabilities[0].source_hash
+            )
+
+    def test_existing_version(self):
+        doc = self.receive_all()[0]
+        history = doc.default_version_map()
+        history._incorporate(doc, BulkActions())
+        with self.assertRaises(InconsistentVersionHistory):
+            history.changes(doc)
+
+    def test_entries(self):
+        initial, later, _ = self.receive_all()
+        history = initial.default_version_map()
+        history._incorporate(initial, BulkActions())
+        self.assertEqual({}, history.entries(later.version))
+        history._incorporate(later, BulkActions())
+        self.assertEqual(
+            {p.sub_id for p in later.iter_parts()}, set(history.entries(later.version))
+        )
+
+
+class TestVersionIndex(BregVersions, TestCase):
+    """Lookups agree with scanning the entries."""
+
+    def test(self):
+        initial, later, stub = self.receive_all()
+        self.serve_parts(later)
+        history = later.default_version_map()
+        for doc in (later, stub, initial):  # includes an insertion
+            history._incorporate(doc, BulkActions())
+        index = history.version_index
+        for a in history.availabilities:
+            scanned = {
+                eh.sub_id: eh
+                for eh in history.exposed_and_hidden
+                if a.version in eh.exposed_versions
+            }
+            self.assertEqual(
+                list(scanned.items()), list(index.version_entries(a.version).items())
+            )
+            for sub_id, eh in scanned.items():
+                self.assertEqual(
+                    eh.hidden_version, index.hidden_version(sub_id, a.version)
+                )
+        for eh in history.exposed_and_hidden:
+            self.assertEqual(
+                [
+                    a.version
+                    for a in history.availabilities
+                    if a.version in index.leaf_versions(eh.sub_id)
+                ],
+                index.leaf_versions(eh.sub_id),
+            )
+            self.assertIn(eh.hidden_version, index.leaf_versions(eh.sub_id))
+        self.assertIsNone(index.hidden_version("ART_999", "initial"))
+        self.assertEqual([], index.leaf_versions("ART_999"))
+        self.assertEqual({}, index.version_entries("19000101"))
+
+
+class TestInsertion(BregVersions, TestCase):
+    """Older version incorporated after a newer one."""
+
+    @staticmethod
+    def contents(history):
+        return {
+            a.version: {
+                sub_id: eh.fingerprint
+                for sub_id, eh in history.entries(a.version).items()
+            }
+            for a in history.availabilities
+        }
+
+    @staticmethod
+    def entries(history):
+        return sorted(
+            (eh.sub_id, eh.hidden_version, list(eh.exposed_versions))
+            for eh in history.exposed_and_hidden
+        )
+
+    def assertChronological(self, history):
+        dates = history.version_to_date
+        for eh in history.exposed_and_hidden:
+            self.assertEqual(eh.hidden_version, eh.exposed_versions[0])
+            self.assertEqual(
+                sorted(eh.exposed_versions, key=dates.get), eh.exposed_versions
+            )
+
+    def test_between(self):
+        """Parts change from each version to the next. Some of the inserted
+        version's parts are identical to the following version's only.
+        """
+        initial, between = self.receive_all()[:2]
+        with open(os.path.join(self.BREG_PATH, "20190930a.html")) as f:
+            source = f.read()
+        later = DocumentReceiver.relaxed_instantiation(
+            source.replace('content="20190930"', 'content="20191231"').replace(
+                "2019-09-30", "2019-12-31"
+            ),
+            logger=Mock(),
+        )
+        sequential = initial.default_version_map()
+        for doc in (initial, between, later):
+            sequential._incorporate(doc, BulkActions())
+        self.serve_parts(initial, later)
+        history = initial.default_version_map()
+        for doc in (initial, later):
+            history._incorporate(doc, BulkActions())
+        history._incorporate(between, BulkActions())
+        self.assertTrue(history._superseded)
+        self.assertChronological(history)
+        self.assertEqual(self.contents(sequential), self.contents(history))
+        self.assertEqual(self.entries(sequential), self.entries(history))
+
+    def test_consistent_with_sequential(self):
+        docs = self.receive_all()
+        sequential = docs[0].default_version_map()
+        for doc in docs:
+            sequential._incorporate(doc, BulkActions())
+        initial, later, stub = self.receive_all()
+        self.serve_parts(later)
+        history = initial.default_version_map()
+        for doc in (later, stub):
+            history._incorporate(doc, BulkActions())
+        following = {
+            sub_id: eh.fingerprint
+            for sub_id, eh in history.entries(later.version).items()
+        }
+        changes = history.changes(initial)
+        bulk = BulkActions()
+        history._incorporate(initial, bulk)
+
+        self.assertEqual(self.contents(sequential), self.contents(history))
+        self.assertEqual(
+            [a.version for a in sequential.availabilities],
+            [a.version for a in history.availabilities],
+        )
+        self.assertChronological(history)
+        differing = {
+            p.sub_id
+            for p in initial.iter_parts()
+            if following.get(p.sub_id) != p.fingerprint
+        }
+        self.assertTrue(differing)
+        self.assertEqual(differing, set(changes["insert"] + changes["update"]))
+        self.assertEqual([], changes["obsolete"])
+        self.assertEqual(self.entries(sequential), self.entries(history))
+        indexed = {p.meta.id for p in initial.iter_parts() if p.sub_id in differing}
+        # The parts shared with the following version are stored under
+        # this version now, with their flags.
+        moved = {
+            p.sub_id: p.meta.id
+            for p in initial.iter_parts()
+            if p.sub_id not in differing
+        }
+        self.assertTrue(moved)
+        self.assertEqual(indexed | set(moved.values()), bulk.indexed())
+        self.assertEqual(
+            {f"{history.meta.id}-{sub_id}-{later.version}" for sub_id in moved},
+            set(history._superseded),
+        )
+        for id_, op in ((a["_id"], a["_op_type"]) for a in bulk.iter_actions()):
+            if op == "index" and id_ not in indexed:
+                self.assertIn(id_, moved.values())
+            elif op != "index":
+                self.assertNotIn(id_, indexed)  # only version labels
+        for part in initial.iter_parts():
+            if part.meta.id in indexed:
+                self.assertFalse(part.abstract.is_latest)
+                if part.sub_id != "COV":
+                    self.assertFalse(part.abstract.in_force)
+
+
+class TestChangeLog(BregVersions, TestCase):
+    """Changes logged per version at ingest."""
+
+    def test(self):
+        initial, later, stub = self.receive_all()
+        self.serve_parts(later)
+        history = later.default_version_map()
+        for doc in (later, stub, initial):  # includes an insertion
+            history._incorporate(doc, BulkActions())
+        self.assertLogged(history)
+        self.assertTrue(history.toc_changed(initial.version))
+        self.assertTrue(list(history.sub_id_change(later.version)))
+
+    def test_without_log(self):
+        initial, later, _ = self.receive_all()
+        history = initial.default_version_map()
+        for doc in (initial, later):
+            history._incorporate(doc, BulkActions())
+        logged = list(history.sub_id_change(later.version))
+        history.change_log = []
+        self.assertEqual(logged, list(history.sub_id_change(later.version)))
+
+
+class TestInForce(BregVersions, TestCase):
+    """Aggregation and update by query, mocked."""
+
+    def setUp(self):
+        docs = self.receive_all()
+        self.history = docs[0].default_version_map()
+        for doc in docs:
+            self.history._incorporate(doc, BulkActions())
+        self.addCleanup(refresh.set_policy, refresh.set_policy("none"))
+
+    @patch("legislative_act.history.IN_FORCE_WAIT_MAX", 0)
+    @patch("legislative_act.history.connections")
+    def test(self, connections):
+        es = connections.get_connection.return_value
+        es.update_by_query.return_value = {"task": "node:1"}
+        figures = {"total": 7, "updated": 2, "noops": 1}
+        es.tasks.get.side_effect = [
+            {"completed": False, "task": {"status": figures}},
+            {
+                "completed": True,
+                "response": {
+                    **figures,
+                    "updated": 6,
+                    "version_conflicts": 0,
+                    "failures": [],
+                },
+            },
+        ]
+        progress = Mock()
+        self.assertEqual(6, self.history.set_in_force(True, progress, interval=0))
+        self.assertEqual([((3, 7),), ((7, 7),)], progress.call_args_list)
+        kwargs = es.update_by_query.call_args[1]
+        self.assertEqual("proceed", kwargs["conflicts"])
+        self.assertFalse(kwargs["wait_for_completion"])
+        body = kwargs["body"]
+        self.assertEqual({"value": True}, body["script"]["params"])
+        (ids,) = [
+            f["ids"]["values"] for f in body["query"]["bool"]["filter"] if "ids" in f
+        ]
+        self.assertEqual(
+            set(self.history.sub_to_global_id(self.history.latest_available).values()),
+            set(ids),
+        )
+
+    @patch.object(dm.index, "refresh")
+    @patch("legislative_act.history.connections")
+    def test_conflicts(self, connections, _):
+        """Small documents are updated within the request, again
+        as long as ES-documents were changed concurrently.
+        """
+        es = connections.get_connection.return_value
+        response = {"total": 7, "noops": 0, "failures": []}
+        es.update_by_query.side_effect = [
+            {**response, "updated": 5, "version_conflicts": 2},
+            {**response, "updated": 2, "version_conflicts": 0},
+        ]
+        self.assertEqual(7, self.history.set_in_force(True, Mock()))
+        self.assertEqual(2, es.update_by_query.call_count)
+        self.assertNotIn("wait_for_completion", es.update_by_query.call_args[1])
+        es.tasks.get.assert_not_called()
+        es.update_by_query.side_effect = None
+        es.update_by_query.return_value = {
+            **response,
+            "updated": 0,
+            "version_conflicts": 1,
+        }
+        with self.assertRaises(RuntimeError):
+            self.history.set_in_force(True, Mock())
+
+    def test_getter(self):
+        searches = []
+
+        def execute(search):
+            searches.append(search.to_dict())
+            return Response(
+                search,
+                {
+                    "hits": {"hits": [], "total": {"value": 7}},
+                    "aggregations": {
+                        "in_force": {"buckets": [{"key": 1, "doc_count": 7}]},
+                        "unset": {"doc_count": 0},
+                    },
+                },
+            )
+
+        with patch.object(Search, "execute", autospec=True) as e:
+            e.side_effect = execute
+            self.assertTrue(self.history.in_force)
+        (search,) = searches
+        self.assertEqual(0, search["size"])
+        self.assertEqual({"in_force", "unset"}, set(search["aggs"]))
+
+    @patch("legislative_act.history.connections")
+    def test_all_versions(self, connections):
+        es = connections.get_connection.return_value
+        es.update_by_query.return_value = {
+            "total": 1,
+            "updated": 0,
+            "noops": 0,
+            "version_conflicts": 0,
+            "failures": ["x"],
+        }
+        with self.assertRaises(RuntimeError):
+            self.history.set_in_force(False, Mock(), interval=0)
+        body = es.update_by_query.call_args[1]["body"]
+        self.assertNotIn("ids", str(body["query"]))
+
+
+class TestRemoveVersion(BregVersions, TestCase):
+    """Writes are captured."""
+
+    def setUp(self):
+        self.committed = []
+        for patcher in (
+            patch.object(
+                BulkActions,
+                "commit",
+                lambda bulk: self.committed.append(
+                    {a["_id"]: a for a in bulk.iter_actions()}
+                ),
+            ),
+            patch.object(DocumentHistory, "save"),
+            patch.object(dm.Cover, "get"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        dm.Cover.get.return_value.abstract.in_force = True
+        self.addCleanup(refresh.set_policy, refresh.set_policy("none"))
+
+    def test_remove_latest(self):
+        initial, later, _ = self.receive_all()
+        history = initial.default_version_map()
+        history._incorporate(initial, BulkActions())
+        expected = deepcopy(history.to_dict())
+        bulk = BulkActions()
+        history._incorporate(later, bulk)
+        incorporated = {a["_id"]: a for a in bulk.iter_actions()}
+        history.remove_latest()
+        self.assertEqual(expected, history.to_dict())
+        (removed,) = self.committed
+        ops = lambda actions, op: {  # noqa: E731
+            i for i, a in actions.items() if a["_op_type"] == op
+        }
+        self.assertEqual(ops(incorporated, "index"), ops(removed, "delete"))
+        self.assertEqual(ops(incorporated, "update"), ops(removed, "update"))
+        for id_ in ops(incorporated, "update"):
+            abstract = removed[id_]["script"]["params"]["abstract"]
+            self.assertTrue(abstract["is_latest"])
+            if "-COV-" not in id_:
+                self.assertTrue(abstract["in_force"])
+
+    @patch.object(dm.index, "refresh")
+    def test_refresh(self, refresh_index):
+        """The bulk request waits for the refresh itself, cf. refresh.py"""
+        for policy, refreshes in (("wait_for", 0), ("explicit", 1)):
+            refresh.set_policy(policy)
+            initial, later, _ = self.receive_all()
+            history = initial.default_version_map()
+            for doc in (initial, later):
+                history._incorporate(doc, BulkActions())
+            refresh_index.reset_mock()
+            history.remove_latest()
+            self.assertEqual(refreshes, refresh_index.call_count, policy)
+
+    def test_remove_inserted(self):
+        initial, later, _ = self.receive_all()
+        self.serve_parts(later)
+        history = later.default_version_map()
+        history._incorporate(later, BulkActions())
+        expected = deepcopy(history.to_dict())
+        bulk = BulkActions()
+        history._incorporate(initial, bulk)
+        history._superseded = ()  # deleted once saved, cf. _write
+        self.serve_parts(later, bulk)
+        history.remove_version(initial.version)
+        self.assertEqual(expected, history.to_dict())
+        # The parts stored under the inserted version are moved back.
+        removed, superseded = self.committed
+        self.assertEqual(
+            bulk.indexed(),
+            {
+                i
+                for c in self.committed
+                for i, a in c.items()
+                if a["_op_type"] == "delete"
+            },
+        )
+        self.assertEqual(
+            {i.replace(initial.version, later.version) for i in superseded},
+            {i for i, a in removed.items() if a["_op_type"] == "index"},
+        )
+        for action in removed.values():
+            if action["_op_type"] == "update":
+                params = action["script"]["params"]
+                self.assertEqual({}, params["abstract"])
+                self.assertEqual(["initial"], params["removed_versions"])
+
+    def test_change_log(self):
+        initial, later, _ = self.receive_all()
+        self.serve_parts(initial)
+        history = initial.default_version_map()
+        for doc in (initial, later):
+            history._incorporate(doc, BulkActions())
+        history.remove_version(initial.version)
+        self.assertLogged(history)
+        self.assertTrue(
+            all(t == "insert" for _, t in history.sub_id_change(later.version))
+        )
+
+
+class TestConflict(BregVersions, TestCase):
+    """Version map changed concurrently, or writes failing."""
+
+    @staticmethod
+    def copy(history):
+        result = DocumentHistory.from_es(
+            {"_id": history.meta.id, "_source": deepcopy(history.to_dict())}
+        )
+        result.meta.seq_no, result.meta.primary_term = 1, 1
+        return result
+
+    def test_remerge(self):
+        concurrent, ours, _ = self.receive_all()
+        history = concurrent.default_version_map()
+        expected = self.copy(history)
+        for doc in (concurrent, ours):
+            expected._incorporate(doc, BulkActions())
+        current = self.copy(history)
+        current._incorporate(concurrent, BulkActions())
+        concurrent, ours, _ = self.receive_all()
+
+        committed = []
+        saved = []
+
+        def commit(bulk):
+            committed.append(list(bulk.iter_actions()))
+
+        def save(h):
+            saved.append(h.to_dict())
+            if len(saved) == 1:
+                raise ConflictError(409, "version_conflict_engine_exception", {})
+
+        with patch.object(BulkActions, "commit", autospec=True) as c, patch.object(
+            DocumentHistory, "save", autospec=True
+        ) as s, patch.object(DocumentHistory, "get", return_value=current):
+            c.side_effect = commit
+            s.side_effect = save
+            self.copy(history).incorporate(ours)
+        self.assertEqual(2, len(committed))
+        first, second = (
+            {a["_id"]: a["_op_type"] for a in actions} for actions in committed
+        )
+        orphans = {
+            id_
+            for id_, op in first.items()
+            if op == "index" and second.get(id_) != "index"
+        }
+        self.assertTrue(orphans)
+        self.assertEqual(orphans, {id_ for id_, op in second.items() if op == "delete"})
+        strip = lambda d: {  # noqa: E731
+            **d,
+            "availabilities": [
+                {k: v for k, v in a.items() if k != "date_received"}
+                for a in d["availabilities"]
+            ],
+        }
+        self.assertEqual(strip(expected.to_dict()), strip(saved[-1]))
+
+    def write_failing(self, commit, save, write=DocumentHistory.incorporate):
+        """Incorporates the later version into the stored initial one.
+        Returns the actions of each commit.
+        """
+        initial, later, _ = self.receive_all()
+        stored = initial.default_version_map()
+        stored._incorporate(initial, BulkActions())
+        committed = []
+
+        def record(bulk):
+            committed.append({a["_id"]: a for a in bulk.iter_actions()})
+            commit(len(committed))
+
+        with patch.object(BulkActions, "commit", autospec=True) as c, patch.object(
+            DocumentHistory, "save", autospec=True
+        ) as s, patch.object(
+            DocumentHistory, "get", side_effect=lambda _: self.copy(stored)
+        ), patch.object(
+            dm.Cover, "get"
+        ) as cover_get:
+            c.side_effect = record
+            s.side_effect = save
+            cover_get.return_value.abstract.in_force = True
+            with self.assertRaises(Exception) as raised:
+                write(self.copy(stored), later)
+        return stored, committed, raised.exception
+
+    def assertRolledBack(self, stored, attempt, rollback):
+        ops = lambda actions, op: {  # noqa: E731
+            i for i, a in actions.items() if a["_op_type"] == op
+        }
+        self.assertTrue(ops(attempt, "index"))
+        self.assertEqual(ops(attempt, "index"), ops(rollback, "delete"))
+        for id_, action in rollback.items():
+            if action["_op_type"] != "update":
+                continue
+            params = action["script"]["params"]
+            self.assertTrue(params["abstract"]["is_latest"])
+            self.assertEqual(["20190930"], params["removed_versions"])
+        self.assertEqual(
+            set(stored.sub_to_global_id(stored.latest_available).values()),
+            ops(rollback, "update"),
+        )
+
+    def test_conflict_rolled_back(self):
+        def save(_):
+            raise ConflictError(409, "version_conflict_engine_exception", {})
+
+        stored, committed, exception = self.write_failing(lambda _: None, save)
+        self.assertIsInstance(exception, ConflictError)
+        self.assertEqual(VERSIONS_MAP_ATTEMPTS + 1, len(committed))
+        self.assertRolledBack(stored, committed[0], committed[-1])
+
+    def test_bulk_error_rolled_back(self):
+        def commit(count):
+            if count == 1:
+                raise BulkWriteError([])
+
+        stored, committed, exception = self.write_failing(commit, Mock())
+        self.assertIsInstance(exception, BulkWriteError)
+        self.assertEqual(2, len(committed))
+        self.assertRolledBack(stored, *committed)
+
+    def test_backfill_rolled_back(self):
+        def commit(count):
+            if count == 1:
+                raise BulkWriteError([])
+
+        stored, committed, _ = self.write_failing(
+            commit, Mock(), lambda history, doc: history.backfill([doc])
+        )
+        self.assertEqual(2, len(committed))
+        self.assertRolledBack(stored, *committed)
+
+
 class TestStub(TestBase):
 
     gt = generics._get_today
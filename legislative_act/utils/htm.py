@@ -5,6 +5,18 @@ from html import escape
 
 blanks = re.compile(r"[\s\n\r\t]+")
 
+# Elements in which the HTML-parser of libxml2 keeps blank text ahead of
+# a tag, if it directly follows their start tag or one of their closed
+# children. Cf. allowPCData in libxml2's HTMLparser.c
+keeps_blanks = frozenset(
+    (
+        "a abbr acronym address applet b bdo big blockquote body button "
+        "caption center cite code dd del dfn div dt em font form "
+        "h1 h2 h3 h4 h5 h6 i iframe ins kbd label legend li noscript object "
+        "p pre q s samp small span strike strong td th tt u var"
+    ).split()
+)
+
 
 def textify(element: et.ElementBase, with_tail=True, simplify_blanks=False):
     """Basically a wrapper of the tostring function from lxml.etree
@@ -36,6 +48,43 @@ def textify(element: et.ElementBase, with_tail=True, simplify_blanks=False):
         ).strip()
 
 
+def _collect_text(element: et.ElementBase, parts: list):
+    # Pretty-printing puts the children on separate lines, if the element
+    # contains no text at all. Below elements that contain text, nothing
+    # is inserted.
+    children = list(element)
+    if (
+        element.text is not None
+        or not children
+        or any(child.tail is not None for child in children)
+    ):
+        parts.append(
+            et.tostring(element, method="text", encoding="unicode", with_tail=False)
+        )
+        return
+    last = element
+    for child in children:
+        if last.tag in keeps_blanks:
+            parts.append("\n")
+        if isinstance(child.tag, str):
+            _collect_text(child, parts)
+            last = child
+    if last.tag in keeps_blanks:
+        parts.append("\n")
+
+
+def text_content(element: et.ElementBase) -> str:
+    """Equivalent to textify(element, simplify_blanks=True, with_tail=False),
+    but without the serialization and re-parsing: The line breaks that
+    pretty-printing would insert and the re-parsing would keep, are
+    inserted while walking the tree.
+    """
+    parts = []
+    _collect_text(element, parts)
+    # Same as blanks.sub(" ", ...).strip(), as both split at str.isspace
+    return " ".join("".join(parts).split())
+
+
 def strip_html(element_string):
     element = et.fromstring(
         "<div>{}</div>".format(element_string), parser=et.HTMLParser()
@@ -74,13 +123,13 @@ def inner_tostring(
     result = ("" if is_negligible(element.text) else escape(element.text)) + "".join(
         [
             et.tostring(sub_element, encoding="unicode", **kwargs)
-            for sub_element in element.xpath("./*")
+            for sub_element in element.iterchildren(et.Element)
         ]
     )
     if skip_ns_declarations:
         result = do_skips(result)
     if simplify_blanks:
-        result = blanks.sub(" ", result)
+        return " ".join(result.split())
     return result.strip()
 
 
@@ -88,4 +137,4 @@ def undress(dressed):
     if type(dressed) is str:
         return strip_html(dressed)
     elif et.iselement(dressed):
-        return textify(dressed, simplify_blanks=True, with_tail=False)
+        return text_content(dressed)
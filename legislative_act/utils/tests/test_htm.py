@@ -1,6 +1,20 @@
 from lxml import etree as et
+import os
 import unittest
-from legislative_act.utils.htm import textify
+from legislative_act.utils.htm import textify, text_content
+
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "tests", "data")
+
+
+def iter_sources():
+    for root, _, files in os.walk(DATA_PATH):
+        for name in sorted(files):
+            if name.endswith(".html"):
+                yield name, et.parse(
+                    os.path.join(root, name),
+                    parser=et.HTMLParser(remove_blank_text=True, remove_comments=True),
+                ).getroot()
 
 
 class TextHtmUtils(unittest.TestCase):
@@ -12,6 +26,28 @@ class TextHtmUtils(unittest.TestCase):
         )
         output = "Hallo Welt Und Tschuess Dies ist ein Beispiel."
         self.assertEqual(textify(input, simplify_blanks=True), output)
+        self.assertEqual(text_content(input), output)
+
+    def test_text_content_separators(self):
+        input = et.fromstring(
+            b"<div><section><p>a</p></section><section><p>b</p></section>"
+            b"<x>c</x><x>d</x><p>e<b>f</b><span>g</span></p></div>",
+            parser=et.HTMLParser(),
+        ).find(".//div")
+        self.assertEqual("a b cdefg", text_content(input))
+        self.assertEqual(
+            textify(input, simplify_blanks=True, with_tail=False),
+            text_content(input),
+        )
+
+    def test_text_content_compatibility(self):
+        for name, source in iter_sources():
+            for element in source.iter(et.Element):
+                self.assertEqual(
+                    textify(element, simplify_blanks=True, with_tail=False),
+                    text_content(element),
+                    f"{name}: {element.tag} {dict(element.attrib)}",
+                )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+"""
+Incorporates several versions of one document at once.
+Usage:
+    python scripts/py/backfill.py [--bulk-load] <file, directory, or manifest> [...]
+Input files as described in scripts/py/paths.py.
+The versions are incorporated in the order of their date_document.
+Their relations are propagated afterwards.
+With --bulk-load, the index is in bulk-load mode meanwhile
+(cf. legislative_act.refresh.bulk_load).
+"""
+from contextlib import nullcontext
+from sys import argv
+import logging
+
+from legislative_act.backlinks import propagate
+from legislative_act.history import DocumentVersion
+from legislative_act.refresh import bulk_load
+from legislative_act.receiver import DocumentReceiver
+from paths import iter_paths
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(paths):
+    docs = []
+    for path in iter_paths(paths):
+        with open(path, encoding="utf-8") as f:
+            docs.append(DocumentReceiver.relaxed_instantiation(f.read(), logger))
+    # Propagated afterwards, cf. __main__.
+    DocumentVersion.save_all(docs, backlinks=False)
+    return docs
+
+
+if __name__ == "__main__":
+    arguments = [a for a in argv[1:] if a != "--bulk-load"]
+    with bulk_load() if "--bulk-load" in argv else nullcontext():
+        docs = backfill(arguments)
+    # Only after bulk_load, the covers are visible to searches.
+    propagate([doc.cover for doc in docs])
+    for doc in docs:
+        print(f"/{doc.domain}/{doc.id_local}/{doc.version}")
+    print("Done")
@@ -0,0 +1,145 @@
+"""
+Incorporates all documents of a directory, e.g. for the initial load of an index.
+Usage:
+    python scripts/py/batch_ingest.py [--bulk-load] [--processes=<n>]
+        [--checkpoint=<file>] <directory, manifest, or file> [...]
+A manifest is a text file listing the paths of HTML files, one per line
+(cf. paths.py).
+The files are parsed by a pool of processes, in rounds of
+BATCH_INGEST_CHUNK_SIZE files. The versions of each document are then
+incorporated in the order of their date_document, with one bulk write
+per document. Versions that are already available are skipped.
+Each processed file is recorded in the checkpoint file (default:
+batch_ingest.checkpoint next to the first argument), once the relations of
+its round are propagated, so that an interrupted run can simply be
+restarted and continues where it stopped.
+With --bulk-load, the index is in bulk-load mode meanwhile
+(cf. legislative_act.refresh.bulk_load).
+"""
+import json
+import logging
+import os
+from collections import defaultdict
+from contextlib import nullcontext
+from dataclasses import fields
+from multiprocessing import Pool
+from sys import argv
+
+from legislative_act import model as dm
+from legislative_act.backlinks import propagate
+from legislative_act.history import DocumentVersion
+from legislative_act.receiver import DocumentReceiver
+from legislative_act.refresh import bulk_load
+from paths import iter_paths
+from settings import BATCH_INGEST_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def read_checkpoint(path) -> set:
+    """Paths processed by previous runs"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {json.loads(line)["path"] for line in f if line.strip()}
+
+
+def parse(path):
+    """Runs in the pool. The receiver is reduced to a plain DocumentVersion,
+    since the parsed source tree cannot be sent back.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            dr = DocumentReceiver.relaxed_instantiation(f.read(), logger, processes=1)
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+    return path, DocumentVersion(**{f.name: getattr(dr, f.name) for f in fields(dr)})
+
+
+def incorporate(docs: list) -> dict:
+    """Incorporates the versions of one document. Returns a message per path."""
+    history = docs[0][1].find_history()
+    known = {a.version for a in history.availabilities}
+    result = {}
+    new = []
+    for path, doc in docs:
+        if doc.version in known:
+            result[path] = f"Already present /{doc.domain}/{doc.id_local}/{doc.version}"
+        else:
+            known.add(doc.version)
+            new.append(doc)
+    if new:
+        DocumentVersion.save_all(new, backlinks=False)
+    for path, doc in docs:
+        result.setdefault(
+            path, f"Uploaded to /{doc.domain}/{doc.id_local}/{doc.version}"
+        )
+    return result
+
+
+def main(paths, checkpoint, processes=None):
+    done = read_checkpoint(checkpoint)
+    todo = [path for path in dict.fromkeys(iter_paths(paths)) if path not in done]
+    print(f"{len(done)} files done before, {len(todo)} to go", flush=True)
+    with Pool(processes) as pool, open(checkpoint, "a", encoding="utf-8") as log:
+        for start in range(0, len(todo), BATCH_INGEST_CHUNK_SIZE):
+            processed = []
+
+            def record(path, message):
+                processed.append({"path": path, "message": message})
+                print(f"{path}: {message}", flush=True)
+
+            documents = defaultdict(list)
+            for path, doc in pool.imap_unordered(
+                parse, todo[start : start + BATCH_INGEST_CHUNK_SIZE]
+            ):
+                if isinstance(doc, str):
+                    record(path, doc)
+                elif doc.date_document is None:
+                    record(path, "ValueError: eli:date_document missing")
+                else:
+                    documents[(doc.domain, doc.id_local)].append((path, doc))
+            covers = []
+            for docs in documents.values():
+                docs.sort(key=lambda item: item[1].date_document)
+                try:
+                    messages = incorporate(docs)
+                except Exception as e:
+                    logger.error("Could not incorporate %s", docs[0][0], exc_info=True)
+                    # not recorded, so that a rerun tries again
+                    print(f"{docs[0][0]}: {type(e).__name__}: {e}", flush=True)
+                    continue
+                covers.extend(doc.cover for _, doc in docs)
+                for path, message in messages.items():
+                    record(path, message)
+            # Within bulk_load, the index is not refreshed on its own. The
+            # relations are only found among the covers visible to searches.
+            dm.index.refresh()
+            propagate(covers)
+            log.writelines(json.dumps(entry) + "\n" for entry in processed)
+            log.flush()
+
+
+def option(name, default=None):
+    for argument in argv[1:]:
+        if argument.startswith(f"--{name}="):
+            return argument.split("=", 1)[1]
+    return default
+
+
+if __name__ == "__main__":
+    arguments = [a for a in argv[1:] if not a.startswith("--")]
+    processes = option("processes")
+    with bulk_load() if "--bulk-load" in argv else nullcontext():
+        main(
+            arguments,
+            option(
+                "checkpoint",
+                os.path.join(
+                    os.path.dirname(os.path.abspath(arguments[0])),
+                    "batch_ingest.checkpoint",
+                ),
+            ),
+            None if processes is None else int(processes),
+        )
+    print("Done")
@@ -0,0 +1,40 @@
+"""
+Compares the run time of text_content to the one of textify, on the article
+bodies of the given HTML files (default: the test data).
+Usage:
+    python scripts/py/benchmark_text_content.py [<file, directory, or manifest> ...]
+Input files as described in scripts/py/paths.py.
+"""
+import os
+import timeit
+from sys import argv
+
+from lxml import etree as et
+
+from legislative_act.utils.htm import textify, text_content
+from paths import iter_paths
+
+DATA_PATH = os.path.join("legislative_act", "tests", "data")
+
+
+def main(paths, number=5):
+    bodies = [
+        element
+        for path in iter_paths(paths)
+        for element in et.parse(
+            path, parser=et.HTMLParser(remove_blank_text=True, remove_comments=True)
+        ).xpath('//*[@class="lxp-body"]')
+    ]
+    textified = timeit.timeit(
+        lambda: [textify(e, simplify_blanks=True, with_tail=False) for e in bodies],
+        number=number,
+    )
+    walked = timeit.timeit(lambda: [text_content(e) for e in bodies], number=number)
+    print(
+        f"text_content: {walked:.4f}s, textify: {textified:.4f}s"
+        f" for {len(bodies)} article bodies, {number} times"
+    )
+
+
+if __name__ == "__main__":
+    main(argv[1:] or [DATA_PATH])
@@ -0,0 +1,32 @@
+"""
+Reports for each document, which parts its upload would insert, update,
+leave unchanged, or make obsolete, and whether the contents table would
+change. Nothing is written to the index.
+Usage:
+    python scripts/py/dry_run.py <domain> <file, directory, or manifest> [...]
+Input files as described in scripts/py/paths.py.
+Prints one JSON object per document.
+"""
+import json
+from sys import argv
+
+from legislative_act.history import InconsistentVersionHistory
+from legislative_act.ingest import dry_run, IngestError
+from paths import iter_paths
+
+
+def main(domain, paths):
+    # Each version map is loaded only once.
+    histories = {}
+    for path in iter_paths(paths):
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        try:
+            result = dry_run(domain, source, histories)
+        except (IngestError, InconsistentVersionHistory) as e:
+            result = {"error": str(e)}
+        print(json.dumps({"path": path, **result}), flush=True)
+
+
+if __name__ == "__main__":
+    main(argv[1], argv[2:])
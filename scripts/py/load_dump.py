@@ -1,9 +1,18 @@
+"""
+Loads dumped ES-documents (one JSON hit per line) from a file or directory.
+Usage:
+    python scripts/py/load_dump.py [--bulk-load] <file or directory>
+With --bulk-load, the index is in bulk-load mode meanwhile
+(cf. legislative_act.refresh.bulk_load).
+"""
 import os
+from contextlib import nullcontext
 from sys import argv
 import json
 from time import sleep
 
 from legislative_act import model as dm
+from legislative_act.refresh import bulk_load
 
 
 def load_single_dump(file_path):
@@ -15,16 +24,24 @@ def load_single_dump(file_path):
         gcd.save()
 
 
-def load_directory(dir_path):
+def load_directory(dir_path, pause=5):
     for file_name in os.listdir(dir_path):
-        sleep(5)
+        sleep(pause)
         load_single_dump(os.path.join(dir_path, file_name))
 
 
-if os.path.isdir(argv[1]):
-    load_directory(argv[1])
-elif os.path.isfile(argv[1]):
-    load_single_dump(argv[1])
+path = [a for a in argv[1:] if a != "--bulk-load"][0]
+if "--bulk-load" in argv:
+    context = bulk_load()
+    pause = 0  # no live search to give way to
+else:
+    context = nullcontext()
+    pause = 5
+with context:
+    if os.path.isdir(path):
+        load_directory(path, pause)
+    elif os.path.isfile(path):
+        load_single_dump(path)
 
 
 if __name__ == "__main__":
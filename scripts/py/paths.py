@@ -0,0 +1,23 @@
+"""
+Input files of the scripts reading documents. Each argument is a directory,
+whose HTML files are taken in alphabetical order, an HTML file, or a
+manifest: a text file listing the paths of HTML files, one per line,
+relative to the manifest's directory.
+"""
+import os
+
+
+def iter_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith(".html"):
+                    yield os.path.join(path, file_name)
+        elif path.endswith(".html"):
+            yield path
+        else:
+            base = os.path.dirname(path)
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield os.path.join(base, line.strip())
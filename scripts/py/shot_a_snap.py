@@ -2,6 +2,7 @@ from datetime import date
 from elasticsearch import Elasticsearch
 
 from legislative_act import model as dm
+from legislative_act.refresh import bulk_load
 
 es = Elasticsearch(timeout=60 * 60)
 
@@ -12,7 +13,10 @@ dm.index._name = dm.index_name
 dm.index.create()
 
 print(f"Start reindexing", flush=True)
-es.reindex(body={"source": {"index": index_name_orig}, "dest": {"index": dm.index_name}})
+with bulk_load(dm.index):
+    es.reindex(
+        body={"source": {"index": index_name_orig}, "dest": {"index": dm.index_name}}
+    )
 print("done", flush=True)
 
 version = date.today().strftime("%Y%m%d")
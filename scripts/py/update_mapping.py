@@ -0,0 +1,6 @@
+"""Adds newly introduced fields (e.g. fingerprints) to the mapping
+of an already existing index."""
+from legislative_act.model import index
+
+index.put_mapping(body=index.to_dict()["mappings"])
+print("Mapping updated.")
@@ -13,6 +13,32 @@ DEFAULT_IRI = f"https://{INTERNET_DOMAIN}"
 
 ES_CONNECTION = "localhost:9200"
 
+# Number of actions and max. payload per request of bulk-writes to the index:
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024**2
+# When writes become visible to searches: "none", "wait_for" or "explicit"
+# (cf. legislative_act/refresh.py):
+REFRESH_POLICY = "wait_for"
+# Number of documents per multi-get request:
+MGET_CHUNK_SIZE = 200
+
+# How to record that an unchanged article is part of a new version:
+#  - "script": appending the version label to the article's abstract.version
+#    via a scripted update.
+#  - "versions_map": only in the VersionsMap. The article is not written at all.
+PART_VERSION_LABELS = "script"
+# Attempts to incorporate a document version, if its version map has been
+# changed concurrently in the meantime:
+VERSIONS_MAP_ATTEMPTS = 3
+# Setting a document's in_force flags waits for the update by query, up to this
+# number of ES-documents. Larger documents are updated by a task on the
+# elasticsearch server, whose progress is polled (and logged) at growing
+# intervals of up to IN_FORCE_PROGRESS_INTERVAL:
+IN_FORCE_WAIT_MAX = 2000
+IN_FORCE_PROGRESS_INTERVAL = 5  # seconds
+# Runs of the update, as long as ES-documents are changed concurrently:
+IN_FORCE_ATTEMPTS = 3
+
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +48,26 @@ CACHE_CONFIG = {"CACHE_TYPE": "simple", "CACHE_DEFAULT_TIMEOUT": 30}
 FS_CACHE_DIR = os.path.join(BASE_DIR, "CACHE")
 FS_CACHE_STALE_AFTER = datetime.timedelta(seconds=2)
 
+# Queue of uploaded documents, processed by the ingest workers
+# (cf. legislative_act/ingest.py):
+INGEST_QUEUE_PATH = os.path.join(BASE_DIR, "ingest_queue.sqlite3")
+INGEST_WORKERS = 2
+INGEST_POLL_INTERVAL = 1.0  # seconds
+# Attempts per job, in case elasticsearch times out, and the delay in between:
+INGEST_MAX_ATTEMPTS = 3
+INGEST_RETRY_DELAY = 10  # seconds
+# Propagate an uploaded document's relations to the documents it refers to
+# (e.g. "amends" -> "amended_by") by a follow-up job, instead of right away:
+INGEST_DEFER_BACKLINKS = True
+# Processes instantiating the articles, definitions and recitals of a received
+# document. Only documents with at least RECEIVER_PARALLEL_MIN_PARTS of those
+# parts are parsed in parallel, since starting the pool has its cost:
+RECEIVER_PROCESSES = 1
+RECEIVER_PARALLEL_MIN_PARTS = 200
+# Files that the batch ingest (scripts/py/batch_ingest.py) parses in one round,
+# before writing their documents:
+BATCH_INGEST_CHUNK_SIZE = 500
+
 FORMAT = "%(levelname)s %(asctime)s %(module)s.%(funcName)s: %(message)s"
 
 logging.basicConfig(
@@ -8,11 +8,9 @@ from legislative_act import model as dm
 from legislative_act.searcher import BasicSearcher
 
 
-def popped(d, key):
-    try:
-        d.pop(key)
-    except KeyError:
-        pass
+def popped(d, *keys):
+    for key in keys:
+        d.pop(key, None)
     return d
 
 
@@ -45,7 +43,8 @@ class SimpleHistory:
             "id_local": self.id_local,
             "in_force": self.in_force,
             "versions": [
-                popped(a.to_dict(), "date_received") for a in self.availabilities
+                popped(a.to_dict(), "date_received", "source_hash")
+                for a in self.availabilities
             ],
         }
 
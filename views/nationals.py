@@ -1,12 +1,12 @@
 from collections import defaultdict
+from copy import deepcopy
 from functools import lru_cache
 from urllib.parse import urlparse
 from hashlib import sha1
 
-from elasticsearch.exceptions import NotFoundError
-
 from legislative_act import model as dm
-from legislative_act.history import flushed
+from legislative_act import refresh
+from legislative_act.bulk import BulkActions, BulkWriteError
 from settings import FOLLOW_DOMAINS
 
 COUNTRIES = {
@@ -89,30 +89,90 @@ def get_nationals(domain, id_local, sub_id=None):
     }
 
 
-@flushed
-def write_nationals(target, url, text, country_name, title=None):
-    assert target.count("-") in (1, 2)
-    assert country_name in COUNTRIES
-    id_ = get_id(text, country_name)
-    try:
-        nr = dm.NationalReference.get(id_)
-    except NotFoundError:
+def check_national(target, url, text, country_name, title=None):
+    if target.count("-") not in (1, 2):
+        raise ValueError(f"Invalid target {target}")
+    if country_name not in COUNTRIES:
+        raise ValueError(f"Unknown country {country_name}")
+
+
+def merged_national(nr, target, url, text, country_name, title=None):
+    """Adds target and url to the NationalReference <nr>,
+    or creates it if <nr> is None.
+    """
+    if nr is None:
         nr = dm.NationalReference(
             country_name=country_name, text=text, urls=[url], references=[target]
         )
         if title is not None:
             nr.title = title
-        nr.meta.id = id_
-    else:
-        assert text == nr.text
-        assert country_name == nr.country_name
-        if getattr(nr, "title", None) is None:
-            nr.title = title
-        if target not in nr.references:
-            nr.references.append(target)
-        if url not in nr.urls:
-            nr.urls.append(url)
-    nr.save()
+        nr.meta.id = get_id(text, country_name)
+        return nr
+    assert text == nr.text
+    assert country_name == nr.country_name
+    if getattr(nr, "title", None) is None:
+        nr.title = title
+    if target not in nr.references:
+        nr.references.append(target)
+    if url not in nr.urls:
+        nr.urls.append(url)
+    return nr
+
+
+@refresh.refreshed
+def upsert_nationals(items: list, within: str = "") -> list:
+    """Writes many national references (keyword arguments of check_national)
+    with one multi-get and one bulk request. Items concerning the same
+    reference are merged. Each item's target has to start with <within>.
+    Returns per item {"id": ..., "result": ...}, where result is one of
+    "created", "updated", "noop", "invalid" or "failed".
+    """
+    results = []
+    for kwargs in items:
+        try:
+            check_national(**kwargs)
+            if not kwargs["target"].startswith(within):
+                raise ValueError(f"Target {kwargs['target']} not within {within}")
+        except (TypeError, ValueError) as e:
+            results.append({"id": None, "result": "invalid", "error": str(e)})
+        else:
+            id_ = get_id(kwargs["text"], kwargs["country_name"])
+            results.append({"id": id_, "result": None})
+    nationals = dm.get_many(
+        dict.fromkeys(r["id"] for r in results if r["id"] is not None),
+        missing="skip",
+    )
+    originals = {id_: deepcopy(nr.to_dict()) for id_, nr in nationals.items()}
+    for kwargs, result in zip(items, results):
+        if result["result"] == "invalid":
+            continue
+        id_ = result["id"]
+        nr = nationals.get(id_)
+        before = None if nr is None else deepcopy(nr.to_dict())
+        try:
+            nationals[id_] = merged_national(nr, **kwargs)
+        except AssertionError:
+            result.update(result="invalid", error=f"Conflicts with {id_}")
+            continue
+        if before is None:
+            result["result"] = "created"
+        elif before != nationals[id_].to_dict():
+            result["result"] = "updated"
+        else:
+            result["result"] = "noop"
+    bulk = BulkActions()
+    for id_, nr in nationals.items():
+        if originals.get(id_) != nr.to_dict():
+            bulk.index(nr)
+    if len(bulk):
+        try:
+            bulk.commit()
+        except BulkWriteError as e:
+            failed = {error["_id"]: error for error in e.errors}
+            for result in results:
+                if result["id"] in failed:
+                    result.update(result="failed", error=failed[result["id"]]["error"])
+    return results
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 import unittest
+from unittest.mock import patch
 
+from legislative_act.bulk import BulkActions
 from legislative_act.model import NationalReference
 
 from views.tests.test_path_responses import ViewsTester
-from views.nationals import get_id
+from views.nationals import get_id, merged_national, upsert_nationals
 
 
 class TestNationalReferences(ViewsTester):
@@ -90,6 +92,74 @@ class TestNationalReferences(ViewsTester):
         nr = NationalReference.get(id_)
         self.assertEqual(nr.references, ["eu-32013R0575", "eu-32013L0036"])
 
+    def test_results(self):
+        response = self.client.post(
+            "/_national_ref/eu/32013R0575/",
+            json={
+                "data": [
+                    {
+                        "url": "https://dejure.org/gesetze/WTU",
+                        "text": "WTU",
+                        "country_name": "Deutschland",
+                    },
+                    {
+                        "url": "https://dejure.org/gesetze/WTU",
+                        "text": "WTU",
+                        "country_name": "Nirvana",
+                    },
+                ]
+            },
+        )
+        self.assertEqual(1, response.json["posted"])
+        self.assertEqual(
+            ["created", "invalid"], [r["result"] for r in response.json["results"]]
+        )
+
+
+class TestUpsert(unittest.TestCase):
+    """One multi-get and one bulk request, both mocked."""
+
+    item = {
+        "target": "eu-32013R0575",
+        "url": "https://dejure.org/gesetze/WTF",
+        "text": "WTF",
+        "country_name": "Deutschland",
+    }
+
+    @patch.object(BulkActions, "commit", autospec=True)
+    @patch("views.nationals.dm.get_many")
+    def test(self, get_many, commit):
+        existing = merged_national(None, **self.item)
+        get_many.return_value = {existing.meta.id: existing}
+        indexed = []
+        commit.side_effect = lambda bulk: indexed.extend(bulk.iter_actions())
+        items = [
+            self.item,
+            {**self.item, "target": "eu-32013L0036"},
+            {**self.item, "text": "WTS"},
+            {**self.item, "text": "WTS"},
+            {**self.item, "target": "eu-32016R0679"},
+            {**self.item, "country_name": "Nirvana"},
+        ]
+        results = upsert_nationals(items, within="eu-32013")
+        self.assertEqual(
+            ["noop", "updated", "created", "noop", "invalid", "invalid"],
+            [r["result"] for r in results],
+        )
+        get_many.assert_called_once()
+        self.assertEqual(
+            [get_id("WTF", "Deutschland"), get_id("WTS", "Deutschland")],
+            list(get_many.call_args[0][0]),
+        )
+        commit.assert_called_once()
+        self.assertEqual(
+            {
+                get_id("WTF", "Deutschland"): ["eu-32013R0575", "eu-32013L0036"],
+                get_id("WTS", "Deutschland"): ["eu-32013R0575"],
+            },
+            {a["_id"]: a["_source"]["references"] for a in indexed},
+        )
+
 
 if __name__ == "__main__":
     unittest.main()